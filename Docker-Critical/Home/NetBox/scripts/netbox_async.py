@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Async NetBox Client
+asyncio access to the NetBox endpoints the sync scripts use, over the pynetbox
+keep-alive session and with a bounded number of in-flight requests
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from requests.adapters import HTTPAdapter
+
+# Configuration
+NETBOX_ASYNC_CONCURRENCY = int(os.getenv('NETBOX_ASYNC_CONCURRENCY', '16'))
+NETBOX_PAGE_SIZE = int(os.getenv('NETBOX_PAGE_SIZE', '500'))
+
+# short name -> (pynetbox app, endpoint)
+ENDPOINTS = {
+    'devices': ('dcim', 'devices'),
+    'interfaces': ('dcim', 'interfaces'),
+    'prefixes': ('ipam', 'prefixes'),
+    'ip_addresses': ('ipam', 'ip_addresses'),
+    'vlans': ('ipam', 'vlans'),
+    'virtual_machines': ('virtualization', 'virtual_machines'),
+    'vm_interfaces': ('virtualization', 'interfaces'),
+}
+
+
+class AsyncNetBox:
+    """Concurrent NetBox client that returns regular pynetbox records
+
+    Requests go through the pynetbox session from a worker pool, so the
+    scripts gain concurrency without another HTTP dependency, and anything
+    wrapping nb.http_session (such as sync_all's shared limit) sees them too.
+    """
+
+    def __init__(self, nb, concurrency=NETBOX_ASYNC_CONCURRENCY):
+        self.nb = nb
+        self.concurrency = max(1, concurrency)
+        self.session = nb.http_session
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.headers = {
+            'Authorization': f'Token {nb.token}',
+            'Accept': 'application/json',
+            'Content-Type': 'application/json',
+        }
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        self._semaphores = {}
+
+    def _semaphore(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._semaphores:
+            self._semaphores = {loop: asyncio.Semaphore(self.concurrency)}
+        return self._semaphores[loop]
+
+    def endpoint(self, name):
+        app, endpoint = ENDPOINTS[name]
+        return getattr(getattr(self.nb, app), endpoint)
+
+    def _record(self, name, values):
+        endpoint = self.endpoint(name)
+        return endpoint.return_obj(values, self.nb, endpoint)
+
+    async def call(self, fn, *args, **kwargs):
+        """Run a blocking call (e.g. a pynetbox save) within the concurrency limit"""
+        async with self._semaphore():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, lambda: fn(*args, **kwargs))
+
+    async def request(self, method, url, params=None, json=None):
+        def send():
+            response = self.session.request(method, url, params=params, json=json, headers=self.headers)
+            response.raise_for_status()
+            return response.json() if response.content else None
+        return await self.call(send)
+
+    def _params(self, filters):
+        return {k: str(v).lower() if isinstance(v, bool) else v for k, v in filters.items()}
+
+    async def list(self, name, **filters):
+        """Fetch every matching object; pages after the first are fetched concurrently"""
+        url = f"{self.endpoint(name).url}/"
+        params = self._params(filters)
+        first = await self.request('GET', url, params={**params, 'limit': NETBOX_PAGE_SIZE, 'offset': 0})
+        results = list(first['results'])
+        offsets = range(NETBOX_PAGE_SIZE, first['count'], NETBOX_PAGE_SIZE)
+        pages = await asyncio.gather(*[
+            self.request('GET', url, params={**params, 'limit': NETBOX_PAGE_SIZE, 'offset': offset})
+            for offset in offsets
+        ])
+        for page in pages:
+            results.extend(page['results'])
+        return [self._record(name, values) for values in results]
+
+    async def get(self, name, **filters):
+        """Return the single matching object or None"""
+        url = f"{self.endpoint(name).url}/"
+        data = await self.request('GET', url, params={**self._params(filters), 'limit': 2})
+        if data['count'] > 1:
+            raise ValueError(f"get() on {name} returned more than one result for {filters}")
+        return self._record(name, data['results'][0]) if data['results'] else None
+
+    async def create(self, name, data):
+        """Create one object (dict) or many (list)"""
+        result = await self.request('POST', f"{self.endpoint(name).url}/", json=data)
+        if isinstance(result, list):
+            return [self._record(name, values) for values in result]
+        return self._record(name, result)
+
+    async def update(self, name, object_id, fields):
+        """Partially update one object"""
+        result = await self.request('PATCH', f"{self.endpoint(name).url}/{object_id}/", json=fields)
+        return self._record(name, result)
+
+    async def delete(self, name, object_ids):
+        """Delete objects by ID with one bulk request"""
+        await self.request('DELETE', f"{self.endpoint(name).url}/",
+                           json=[{'id': object_id} for object_id in object_ids])
+
+    def gather(self, *coros, return_exceptions=False):
+        """Run coroutines concurrently from synchronous code and return their results"""
+        async def run():
+            return await asyncio.gather(*coros, return_exceptions=return_exceptions)
+        return asyncio.run(run())
+
+    def close(self):
+        # The session belongs to pynetbox, so only the worker pool is shut down here
+        self.executor.shutdown(wait=False)
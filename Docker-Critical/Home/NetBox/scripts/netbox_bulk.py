@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+NetBox Bulk Writer
+Queues creates, updates and deletes per endpoint and sends them as chunked list payloads
+"""
+
+import os
+
+BULK_CHUNK_SIZE = int(os.getenv('NETBOX_BULK_CHUNK_SIZE', '100'))
+
+
+class Pending:
+    """Placeholder for an object that is queued for creation but not yet written"""
+
+    def __init__(self, key):
+        self.key = key
+        self.record = None
+
+    @property
+    def id(self):
+        if self.record is None:
+            raise RuntimeError(f"Pending object {self.key!r} has not been written yet")
+        return self.record.id
+
+
+def ref(obj):
+    """Return a value usable as a foreign key in a queued payload"""
+    return obj if isinstance(obj, Pending) else obj.id
+
+
+class BulkWriter:
+    """Batches NetBox writes so each endpoint costs one request per chunk"""
+
+    def __init__(self, chunk_size=BULK_CHUNK_SIZE):
+        self.chunk_size = max(1, chunk_size)
+        self.endpoints = {}
+        self.creates = {}
+        self.updates = {}
+        self.deletes = {}
+        self.pending = {}
+
+    def _register(self, endpoint):
+        self.endpoints.setdefault(endpoint.url, endpoint)
+        self.creates.setdefault(endpoint.url, [])
+        self.updates.setdefault(endpoint.url, {})
+        self.deletes.setdefault(endpoint.url, [])
+        return endpoint.url
+
+    def create(self, endpoint, payload, key=None):
+        """Queue a create and return a Pending handle usable in dependent payloads"""
+        url = self._register(endpoint)
+        pending = Pending(key)
+        self.creates[url].append((pending, payload))
+        if key is not None:
+            self.pending[key] = pending
+        return pending
+
+    def update(self, endpoint, object_id, fields):
+        """Queue a partial update, merging with any update already queued for the object"""
+        if not fields:
+            return
+        url = self._register(endpoint)
+        self.updates[url].setdefault(object_id, {}).update(fields)
+
+    def delete(self, endpoint, object_id):
+        """Queue a delete; deletes are sent after all creates and updates"""
+        url = self._register(endpoint)
+        self.deletes[url].append(object_id)
+
+    def get(self, key):
+        """Return the record created for a queued key, once flushed"""
+        pending = self.pending.get(key)
+        return pending.record if pending else None
+
+    def _resolve(self, payload):
+        return {k: v.id if isinstance(v, Pending) else v for k, v in payload.items()}
+
+    def _ready(self, payload):
+        return all(v.record is not None for v in payload.values() if isinstance(v, Pending))
+
+    def _chunks(self, items):
+        for i in range(0, len(items), self.chunk_size):
+            yield items[i:i + self.chunk_size]
+
+    def _flush_creates(self):
+        """Create objects in passes so parents are written before their dependents"""
+        created = 0
+        while any(self.creates.values()):
+            progressed = False
+            for url, endpoint in self.endpoints.items():
+                ready = [item for item in self.creates[url] if self._ready(item[1])]
+                if not ready:
+                    continue
+                self.creates[url] = [item for item in self.creates[url] if not self._ready(item[1])]
+                for chunk in self._chunks(ready):
+                    records = endpoint.create([self._resolve(payload) for _, payload in chunk])
+                    for (pending, _), record in zip(chunk, records):
+                        pending.record = record
+                    created += len(chunk)
+                progressed = True
+            if not progressed:
+                raise RuntimeError("Queued creates reference objects that were never queued")
+        return created
+
+    def flush_deletes(self):
+        """Send queued deletes in endpoint registration order; returns the count"""
+        deleted = 0
+        for url, endpoint in self.endpoints.items():
+            for chunk in self._chunks(self.deletes[url]):
+                endpoint.delete(chunk)
+                deleted += len(chunk)
+            self.deletes[url] = []
+        return deleted
+
+    def flush(self):
+        """Send all queued writes; returns (created, updated) counts"""
+        created = self._flush_creates()
+        updated = 0
+        for url, endpoint in self.endpoints.items():
+            queued = [{'id': object_id, **self._resolve(fields)}
+                      for object_id, fields in self.updates[url].items()]
+            for chunk in self._chunks(queued):
+                endpoint.update(chunk)
+                updated += len(chunk)
+            self.updates[url].clear()
+        self.flush_deletes()
+        return created, updated
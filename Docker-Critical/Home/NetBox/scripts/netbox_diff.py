@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+NetBox Change Detection
+Compares desired field values with a fetched record so only real changes are written
+"""
+
+from netbox_bulk import Pending
+
+MAC_FIELDS = {'mac_address'}
+
+
+def normalize_mac(value):
+    """Normalize a MAC address to upper-case colon notation"""
+    if not value:
+        return None
+    return str(value).replace('-', ':').upper()
+
+
+def normalize(field, value):
+    """Normalize a field value so equivalent representations compare equal"""
+    if isinstance(value, Pending):
+        return value
+    if hasattr(value, 'id'):
+        value = value.id
+    elif isinstance(value, dict) and 'id' in value:
+        value = value['id']
+    elif isinstance(value, dict) and 'value' in value and field != 'custom_fields':
+        value = value['value']
+    if field in MAC_FIELDS:
+        return normalize_mac(value)
+    if value == '':
+        return None
+    return value
+
+
+def changed_fields(record, desired):
+    """Return the subset of desired fields that differ from the record"""
+    current = record.serialize()
+    changes = {}
+    for field, value in desired.items():
+        if field == 'custom_fields':
+            current_cf = current.get('custom_fields') or {}
+            cf_changes = {
+                k: v for k, v in (value or {}).items()
+                if normalize(k, current_cf.get(k)) != normalize(k, v)
+            }
+            if cf_changes:
+                changes['custom_fields'] = cf_changes
+        elif normalize(field, current.get(field)) != normalize(field, value):
+            changes[field] = value
+    return changes
+
+
+class SyncStats:
+    """Counts created, updated and unchanged objects for a sync section"""
+
+    def __init__(self, label):
+        self.label = label
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+
+    def summary(self):
+        return (f"{self.label}: {self.created} created, {self.updated} updated, "
+                f"{self.unchanged} unchanged")
+
+
+def apply_changes(record, desired, stats=None, writer=None):
+    """Write only the changed fields of record; returns True if anything changed"""
+    changes = changed_fields(record, desired)
+    if not changes:
+        if stats:
+            stats.unchanged += 1
+        return False
+    if writer:
+        writer.update(record.endpoint, record.id, changes)
+    else:
+        record.update(changes)
+    if stats:
+        stats.updated += 1
+    return True
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Prefix Index
+Longest-prefix-match and overlap checks over NetBox prefixes, answered from memory
+"""
+
+import bisect
+import ipaddress
+
+
+class PrefixIndex:
+    """Binary trie of prefixes; a lookup walks at most one node per prefix bit
+
+    Nodes are [child0, child1, entry] lists, entry being (network, record) for
+    a prefix that ends at that node. Record is the NetBox prefix if known.
+    """
+
+    def __init__(self):
+        self.roots = {4: [None, None, None], 6: [None, None, None]}
+        self.count = 0
+
+    def add(self, prefix, record=None):
+        """Index a prefix; a source subnet never replaces a NetBox record already indexed"""
+        # Containers are aggregates, not subnets, so they never decide an address's mask
+        if record is not None and getattr(record.status, 'value', record.status) == 'container':
+            return
+        network = ipaddress.ip_network(str(prefix), strict=False)
+        node = self.roots[network.version]
+        address = int(network.network_address)
+        for i in range(network.prefixlen):
+            bit = (address >> (network.max_prefixlen - 1 - i)) & 1
+            if node[bit] is None:
+                node[bit] = [None, None, None]
+            node = node[bit]
+        if node[2] is None:
+            self.count += 1
+            node[2] = (network, record)
+        elif record is not None:
+            node[2] = (network, record)
+
+    def load(self, nb, **filters):
+        """Index NetBox prefixes with one paginated read"""
+        for prefix in nb.ipam.prefixes.filter(**filters):
+            self.add(prefix.prefix, prefix)
+        return self.count
+
+    def lookup(self, address):
+        """Return (network, record) of the longest prefix containing address, or None"""
+        try:
+            host = ipaddress.ip_address(str(address).split('/')[0])
+        except ValueError:
+            return None
+        node = self.roots[host.version]
+        value = int(host)
+        # A default route (/0) says nothing about the address's subnet, so it never matches
+        best = None
+        for i in range(host.max_prefixlen):
+            node = node[(value >> (host.max_prefixlen - 1 - i)) & 1]
+            if node is None:
+                break
+            if node[2] is not None:
+                best = node[2]
+        return best
+
+    def with_prefix(self, address, default, current=None):
+        """address/len using the longest matching prefix, or default when none matches
+
+        current is the address already in NetBox: its mask is kept unless a prefix
+        at least as specific matches, so a supernet never widens a real subnet mask.
+        """
+        host = str(address).split('/')[0]
+        match = self.lookup(host)
+        if current:
+            known = ipaddress.ip_interface(str(current)).network
+            if known.prefixlen < known.max_prefixlen and (not match or match[0].prefixlen < known.prefixlen):
+                return f"{host}/{known.prefixlen}"
+        return f"{host}/{match[0].prefixlen if match else default}"
+
+
+class PrefixIntervals:
+    """Prefixes kept as sorted (start, -end) intervals for bisect-based reconciliation
+
+    CIDR prefixes never partially overlap: two prefixes are equal, nested or
+    disjoint. So for an incoming network, everything it would contain starts
+    inside it and sits in one contiguous run of the sorted list.
+    """
+
+    def __init__(self):
+        self.keys = {4: [], 6: []}
+        self.entries = {4: [], 6: []}
+
+    def _key(self, network):
+        return (int(network.network_address), -int(network.broadcast_address))
+
+    def __iter__(self):
+        """Every (network, record) pair, IPv4 first"""
+        for version in (4, 6):
+            yield from self.entries[version]
+
+    def add(self, prefix, record=None):
+        """Insert one prefix, e.g. one queued for creation earlier in the run"""
+        network = ipaddress.ip_network(str(prefix), strict=False)
+        key = self._key(network)
+        i = bisect.bisect_right(self.keys[network.version], key)
+        self.keys[network.version].insert(i, key)
+        self.entries[network.version].insert(i, (network, record))
+
+    def set_record(self, prefix, record):
+        """Replace the placeholder added for a queued prefix with its created record"""
+        network = ipaddress.ip_network(str(prefix), strict=False)
+        key = self._key(network)
+        keys, entries = self.keys[network.version], self.entries[network.version]
+        i = bisect.bisect_left(keys, key)
+        while i < len(keys) and keys[i] == key:
+            if entries[i][1] is None:
+                entries[i] = (network, record)
+                return
+            i += 1
+
+    def load(self, nb, **filters):
+        """Load NetBox prefixes with one paginated read"""
+        return self.extend((prefix.prefix, prefix) for prefix in nb.ipam.prefixes.filter(**filters))
+
+    def extend(self, prefixes):
+        """Add many (prefix, record) pairs, sorting once"""
+        for prefix, record in prefixes:
+            network = ipaddress.ip_network(str(prefix), strict=False)
+            self.keys[network.version].append(self._key(network))
+            self.entries[network.version].append((network, record))
+        count = 0
+        for version in self.keys:
+            order = sorted(range(len(self.keys[version])), key=self.keys[version].__getitem__)
+            self.keys[version] = [self.keys[version][i] for i in order]
+            self.entries[version] = [self.entries[version][i] for i in order]
+            count += len(order)
+        return count
+
+    def exact(self, network):
+        """(network, record) for the same prefix, or None"""
+        same = self.same(network)
+        return same[0] if same else None
+
+    def same(self, network):
+        """Every (network, record) for exactly this prefix, whatever its VRF"""
+        keys = self.keys[network.version]
+        key = self._key(network)
+        lo = bisect.bisect_left(keys, key)
+        hi = bisect.bisect_right(keys, key)
+        return self.entries[network.version][lo:hi]
+
+    def parent(self, network):
+        """Closest existing prefix that strictly contains network, or None"""
+        for prefixlen in range(network.prefixlen - 1, -1, -1):
+            match = self.exact(network.supernet(new_prefix=prefixlen))
+            if match:
+                return match
+        return None
+
+    def children(self, network):
+        """Existing prefixes strictly inside network"""
+        keys = self.keys[network.version]
+        lo = bisect.bisect_right(keys, self._key(network))
+        hi = bisect.bisect_right(keys, (int(network.broadcast_address), 0))
+        return [entry for entry in self.entries[network.version][lo:hi] if entry[0] != network]
+
+    def classify(self, prefix):
+        """Return (relation, matches) for an incoming prefix in the global VRF
+
+        'exact'  - the prefix already exists there; matches lists every copy
+        'covers' - it is a parent of existing prefixes; matches lists them
+        'within' - it fits under an existing prefix; matches is [parent]
+        'new'    - nothing related exists
+        """
+        network = ipaddress.ip_network(str(prefix), strict=False)
+        # The syncs write global prefixes, so a copy in another VRF is not a match
+        same = [entry for entry in self.same(network) if getattr(entry[1], 'vrf', None) is None]
+        if same:
+            return 'exact', same
+        inside = self.children(network)
+        if inside:
+            return 'covers', inside
+        parent = self.parent(network)
+        if parent:
+            return 'within', [parent]
+        return 'new', []
+
+
+def plan_prefixes(intervals, prefixes):
+    """Split incoming prefixes into (creates, matches, conflicts) before anything is written
+
+    creates   - [(prefix, relation, related)], added to intervals as they are planned;
+                related is [parent] for 'within' and the existing children for 'covers'
+    matches   - [(prefix, existing record)]
+    conflicts - [(prefix, duplicates)] when the global VRF already holds the prefix
+                more than once, so there is no single record to update
+    NetBox nests prefixes by itself, so parents and children are both created.
+    Shorter prefixes are planned first, so a parent queued in the same run is
+    reported as such by its subnets.
+    """
+    creates, matches, conflicts = [], [], []
+    for prefix in sorted(prefixes, key=lambda p: (ipaddress.ip_network(p, strict=False).version,
+                                                  ipaddress.ip_network(p, strict=False).prefixlen)):
+        relation, found = intervals.classify(prefix)
+        if relation == 'exact' and len(found) > 1:
+            conflicts.append((prefix, found))
+        elif relation == 'exact':
+            matches.append((prefix, found[0][1]))
+        else:
+            creates.append((prefix, relation, found))
+            intervals.add(prefix)
+    return creates, matches, conflicts
+
+
+def relation_note(relation, related):
+    """Short log note placing a new prefix in the existing hierarchy"""
+    if relation == 'within':
+        return f" (inside {related[0][0]})"
+    if relation == 'covers':
+        return f" (parent of {len(related)} existing prefixes)"
+    return ''
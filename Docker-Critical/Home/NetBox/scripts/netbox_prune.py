@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Stale Object Pruning
+Tags objects a sync creates as owned by its source and bulk-deletes owned
+objects the source no longer reports
+"""
+
+import os
+
+from netbox_bulk import BulkWriter
+
+# Configuration
+SYNC_PRUNE = os.getenv('SYNC_PRUNE', 'true').lower() == 'true'
+SYNC_PRUNE_DRY_RUN = os.getenv('SYNC_PRUNE_DRY_RUN', 'false').lower() == 'true'
+SYNC_PRUNE_MAX_DELETE = int(os.getenv('SYNC_PRUNE_MAX_DELETE', '50'))
+
+
+def owner_slug(source):
+    return f"sync-{source}"
+
+
+def owner_tag(resolver, source):
+    """Tag marking objects created by a sync source, e.g. sync-docker"""
+    return resolver.tag(owner_slug(source), slug=owner_slug(source), color='607d8b')
+
+
+def tag_ids(record):
+    """IDs of the tags currently on a record"""
+    return [tag['id'] if isinstance(tag, dict) else tag for tag in record.serialize().get('tags') or []]
+
+
+def owned_elsewhere(record, tag):
+    """True if record carries another sync source's owner tag"""
+    for other in record.tags or []:
+        slug = other['slug'] if isinstance(other, dict) else getattr(other, 'slug', '')
+        other_id = other['id'] if isinstance(other, dict) else getattr(other, 'id', None)
+        if slug.startswith(owner_slug('')) and other_id != tag.id:
+            return True
+    return False
+
+
+def claim(record, tag, desired):
+    """Add the owner tag to desired fields if a matched record does not carry it yet"""
+    current = tag_ids(record)
+    if tag.id not in current:
+        desired['tags'] = current + [tag.id]
+    return desired
+
+
+class Pruner:
+    """Collects owned objects missing from the source and deletes them in bulk
+
+    Callers must only offer objects of a kind whose source listing succeeded,
+    otherwise a failed fetch would look like every object was removed.
+    """
+
+    def __init__(self, source, tag, dry_run=SYNC_PRUNE_DRY_RUN, max_delete=SYNC_PRUNE_MAX_DELETE):
+        self.source = source
+        self.tag = tag
+        self.slug = owner_slug(source)
+        self.dry_run = dry_run
+        self.max_delete = max_delete
+        self.stale = []
+
+    def check(self, endpoint, records, keep, key, label):
+        """Queue records whose key is not in keep; returns the stale records"""
+        stale = [record for record in records if key(record) not in keep]
+        self.stale.extend((endpoint, record, label) for record in stale)
+        return stale
+
+    def run(self):
+        """Delete queued objects; returns the records actually deleted"""
+        print(f"\n=== Pruning stale {self.source} objects ===")
+        if not SYNC_PRUNE:
+            print("  Pruning disabled (SYNC_PRUNE=false)")
+            return []
+        if not self.stale:
+            print("  Nothing to prune")
+            return []
+
+        refused = len(self.stale) > self.max_delete
+        for _, record, label in self.stale:
+            print(f"  {'Would delete' if self.dry_run or refused else 'Deleting'} {label}: {record}")
+        if refused:
+            print(f"  ✗ Refusing to delete {len(self.stale)} objects "
+                  f"(SYNC_PRUNE_MAX_DELETE={self.max_delete})")
+            return []
+        if self.dry_run:
+            print(f"  Dry run: {len(self.stale)} objects left in place")
+            return []
+
+        writer = BulkWriter()
+        for endpoint, record, _ in self.stale:
+            writer.delete(endpoint, record.id)
+        deleted = writer.flush_deletes()
+        print(f"  ✓ Deleted {deleted} stale objects")
+        return [record for _, record, _ in self.stale]
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+NetBox Reference Resolver
+Memoizes site, manufacturer, role, type, cluster and VLAN group lookups and
+persists their IDs to a small on-disk cache so warm runs skip them entirely
+"""
+
+import json
+import os
+import time
+
+import pynetbox
+
+# Configuration
+NETBOX_URL = os.getenv('NETBOX_URL', 'http://localhost:8080')
+SYNC_CACHE_DIR = os.getenv('SYNC_CACHE_DIR', os.path.expanduser('~/.cache/netbox-sync'))
+RESOLVER_CACHE_TTL = int(os.getenv('RESOLVER_CACHE_TTL', '3600'))
+
+
+def slugify(name):
+    """Build a NetBox slug the same way the sync scripts always have"""
+    return name.lower().replace(' ', '-').replace('(', '').replace(')', '')
+
+
+class CachedRef:
+    """Stand-in for a reference object restored from the on-disk cache"""
+
+    def __init__(self, id, name, key=None):
+        self.id = id
+        self.name = name
+        self.key = key
+
+    def __repr__(self):
+        return self.name
+
+
+class ReferenceResolver:
+    """Get-or-create helper for the reference objects every sync script needs"""
+
+    def __init__(self, nb, cache_file=None, ttl=RESOLVER_CACHE_TTL):
+        self.nb = nb
+        self.ttl = ttl
+        self.cache_file = cache_file or os.path.join(SYNC_CACHE_DIR, 'references.json')
+        self.memo = {}
+        self.disk = self._load()
+        self.sources = {}
+        self.dropped = set()
+        self.dirty = False
+
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get('netbox_url') != NETBOX_URL:
+            return {}
+        now = time.time()
+        return {k: v for k, v in data.get('refs', {}).items() if now - v['ts'] < self.ttl}
+
+    def save(self):
+        """Persist resolved IDs, merging with entries written by concurrent runs"""
+        if not self.dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            # Entries invalidated this run must not come back from the merge
+            refs = {k: v for k, v in self._load().items() if k not in self.dropped}
+            refs.update(self.disk)
+            tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump({'netbox_url': NETBOX_URL, 'refs': refs}, f)
+            os.replace(tmp, self.cache_file)
+            self.dropped.clear()
+            self.dirty = False
+        except OSError as e:
+            print(f"  ✗ Could not write reference cache: {e}")
+
+    def invalidate(self, *keys):
+        """Drop memoized and cached references (all of them if no keys are given) and rewrite the cache"""
+        keys = set(keys) or set(self.memo) | set(self.disk) | set(self._load())
+        for key in keys:
+            self.memo.pop(key, None)
+            self.disk.pop(key, None)
+        self.dropped.update(keys)
+        self.dirty = True
+        self.save()
+
+    def refresh(self, obj):
+        """Resolve a cached reference again, bypassing the cache; other objects are returned as-is"""
+        if not isinstance(obj, CachedRef) or obj.key not in self.sources:
+            return obj
+        self.invalidate(obj.key)
+        return self._resolve(obj.key, *self.sources[obj.key])
+
+    def _create_with(self, create, *refs):
+        """Run create(*refs), retrying once with fresh references if NetBox rejects cached ones
+
+        A reference deleted from NetBox stays cached until its TTL runs out, and
+        every create that points at its ID fails with a 400 until then.
+        """
+        try:
+            return create(*refs)
+        except pynetbox.RequestError as e:
+            stale = [ref for ref in refs if isinstance(ref, CachedRef)]
+            if getattr(e.req, 'status_code', None) != 400 or not stale:
+                raise
+            print(f"  ✗ NetBox rejected cached references ({', '.join(str(ref) for ref in stale)}); refreshing them")
+            return create(*[self.refresh(ref) for ref in refs])
+
+    def _resolve(self, key, lookup, create):
+        self.sources.setdefault(key, (lookup, create))
+        if key in self.memo:
+            return self.memo[key]
+        entry = self.disk.get(key)
+        if entry:
+            obj = CachedRef(entry['id'], entry['name'], key)
+        else:
+            obj = lookup() or create()
+            self.disk[key] = {'id': obj.id, 'name': str(obj), 'ts': time.time()}
+            self.dirty = True
+        self.memo[key] = obj
+        return obj
+
+    def site(self, name, slug=None):
+        """Ensure site exists"""
+        return self._resolve(
+            f"site:{name}",
+            lambda: self.nb.dcim.sites.get(name=name),
+            lambda: self.nb.dcim.sites.create(name=name, slug=slug or slugify(name))
+        )
+
+    def manufacturer(self, name, slug=None):
+        """Ensure manufacturer exists"""
+        return self._resolve(
+            f"manufacturer:{name}",
+            lambda: self.nb.dcim.manufacturers.get(name=name),
+            lambda: self.nb.dcim.manufacturers.create(name=name, slug=slug or slugify(name))
+        )
+
+    def device_role(self, name, color='9e9e9e', slug=None):
+        """Ensure device role exists"""
+        return self._resolve(
+            f"device_role:{name}",
+            lambda: self.nb.dcim.device_roles.get(name=name),
+            lambda: self.nb.dcim.device_roles.create(
+                name=name,
+                slug=slug or slugify(name),
+                color=color
+            )
+        )
+
+    def device_type(self, manufacturer, model, slug=None):
+        """Ensure device type exists"""
+        return self._resolve(
+            f"device_type:{model}",
+            lambda: self.nb.dcim.device_types.get(model=model),
+            lambda: self._create_with(lambda m: self._create_device_type(m, model, slug), manufacturer)
+        )
+
+    def device_types(self, manufacturer, models):
+        """Ensure several device types exist, looking up unknown models with one query"""
+        unknown = [m for m in models if f"device_type:{m}" not in self.memo and f"device_type:{m}" not in self.disk]
+        found = {}
+        if unknown:
+            found = {dt.model: dt for dt in self.nb.dcim.device_types.filter(model=unknown)}
+        return {
+            model: self._resolve(
+                f"device_type:{model}",
+                lambda model=model: found.get(model),
+                lambda model=model: self._create_with(lambda m: self._create_device_type(m, model), manufacturer)
+            )
+            for model in models
+        }
+
+    def _create_device_type(self, manufacturer, model, slug=None):
+        return self.nb.dcim.device_types.create(
+            manufacturer=manufacturer.id,
+            model=model,
+            slug=slug or slugify(model)
+        )
+
+    def cluster_type(self, name, slug=None):
+        """Ensure virtualization cluster type exists"""
+        return self._resolve(
+            f"cluster_type:{name}",
+            lambda: self.nb.virtualization.cluster_types.get(name=name),
+            lambda: self.nb.virtualization.cluster_types.create(name=name, slug=slug or slugify(name))
+        )
+
+    def cluster(self, name, cluster_type, site=None):
+        """Ensure virtualization cluster exists"""
+        def create(cluster_type, site):
+            fields = {'name': name, 'type': cluster_type.id}
+            if site:
+                fields['site'] = site.id
+            return self.nb.virtualization.clusters.create(**fields)
+        return self._resolve(
+            f"cluster:{name}",
+            lambda: self.nb.virtualization.clusters.get(name=name),
+            lambda: self._create_with(create, cluster_type, site)
+        )
+
+    def vlan_group(self, name, slug=None):
+        """Ensure VLAN group exists"""
+        return self._resolve(
+            f"vlan_group:{name}",
+            lambda: self.nb.ipam.vlan_groups.get(name=name),
+            lambda: self.nb.ipam.vlan_groups.create(name=name, slug=slug or slugify(name))
+        )
+
+    def tag(self, name, slug=None, color='9e9e9e'):
+        """Ensure tag exists"""
+        return self._resolve(
+            f"tag:{name}",
+            lambda: self.nb.extras.tags.get(name=name),
+            lambda: self.nb.extras.tags.create(name=name, slug=slug or slugify(name), color=color)
+        )
+
+    def device(self, name, device_type, role, site, **fields):
+        """Ensure device exists; memoized for this run only since callers edit the record"""
+        key = f"device:{name}"
+        if key not in self.memo:
+            device = self.nb.dcim.devices.get(name=name)
+            if not device:
+                device = self._create_with(
+                    lambda device_type, role, site: self.nb.dcim.devices.create(
+                        name=name,
+                        device_type=device_type.id,
+                        role=role.id,
+                        site=site.id,
+                        **fields
+                    ),
+                    device_type, role, site
+                )
+                print(f"  ✓ Created device: {name}")
+            self.memo[key] = device
+        return self.memo[key]
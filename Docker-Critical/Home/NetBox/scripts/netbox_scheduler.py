@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Dependency-Aware Write Scheduler
+Runs chains of dependent NetBox writes (device -> interface -> IP) as a DAG so
+independent chains proceed concurrently while each chain keeps its order
+"""
+
+import asyncio
+import os
+
+# Configuration
+SYNC_WORKERS = int(os.getenv('SYNC_WORKERS', '8'))
+
+
+class DependencyFailed(Exception):
+    """Raised for a task whose parent failed, so it was never started"""
+
+    def __init__(self, key, parent):
+        super().__init__(f"skipped {key}: {parent} failed")
+        self.parent = parent
+
+
+class WriteScheduler:
+    """Collects async tasks with dependencies and runs them on a bounded pool"""
+
+    def __init__(self, workers=SYNC_WORKERS):
+        self.workers = max(1, workers)
+        self.tasks = {}
+        self.results = {}
+        self.failures = {}
+        self.skipped = {}
+
+    def add(self, key, fn, after=()):
+        """Register an async task; fn is awaited with the results of its parents"""
+        if key in self.tasks:
+            raise ValueError(f"Duplicate task key: {key}")
+        missing = [parent for parent in after if parent not in self.tasks]
+        if missing:
+            raise ValueError(f"Task {key} depends on unknown tasks: {missing}")
+        self.tasks[key] = (fn, tuple(after))
+        return key
+
+    def run(self):
+        """Run every task; returns True if nothing failed or was skipped"""
+        asyncio.run(self._run())
+        return not self.failures and not self.skipped
+
+    async def _run(self):
+        slots = asyncio.Semaphore(self.workers)
+        futures = {}
+
+        async def run_task(key):
+            fn, after = self.tasks[key]
+            parents = []
+            for parent in after:
+                try:
+                    parents.append(await futures[parent])
+                except Exception:
+                    raise DependencyFailed(key, parent)
+            async with slots:
+                return await fn(*parents)
+
+        # Tasks can only depend on earlier keys, so insertion order is a valid topological order
+        for key in self.tasks:
+            futures[key] = asyncio.ensure_future(run_task(key))
+        await asyncio.gather(*futures.values(), return_exceptions=True)
+
+        for key, future in futures.items():
+            error = future.exception()
+            if isinstance(error, DependencyFailed):
+                self.skipped[key] = error
+            elif error:
+                self.failures[key] = error
+            else:
+                self.results[key] = future.result()
+
+    def report(self):
+        """Print failed and skipped tasks"""
+        for key, error in self.failures.items():
+            print(f"  ✗ {key}: {error}")
+        if self.skipped:
+            print(f"  ✗ Skipped {len(self.skipped)} dependent tasks")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+NetBox Snapshot Index
+Pulls NetBox objects once with paginated list calls and serves lookups from memory
+"""
+
+
+class NetBoxSnapshot:
+    """In-memory index of NetBox objects used by the sync scripts"""
+
+    def __init__(self, nb):
+        self.nb = nb
+        self.vms = {}
+        self.devices = {}
+        self.vm_interfaces = {}
+        self.interfaces = {}
+        self.ip_addresses = {}
+        self.assigned_ips = {}
+        self.ip_hosts = {}
+        self.vlans = {}
+        self.prefixes = {}
+
+    def load_virtual_machines(self, **filters):
+        """Index virtual machines by name"""
+        for vm in self.nb.virtualization.virtual_machines.filter(**filters):
+            self.add_vm(vm)
+        return len(self.vms)
+
+    def load_devices(self, **filters):
+        """Index devices by name"""
+        for device in self.nb.dcim.devices.filter(**filters):
+            self.add_device(device)
+        return len(self.devices)
+
+    def load_vm_interfaces(self, **filters):
+        """Index VM interfaces by (vm_id, interface name)"""
+        for interface in self.nb.virtualization.interfaces.filter(**filters):
+            self.add_vm_interface(interface)
+        return len(self.vm_interfaces)
+
+    def load_interfaces(self, **filters):
+        """Index device interfaces by (device_id, interface name)"""
+        for interface in self.nb.dcim.interfaces.filter(**filters):
+            self.add_interface(interface)
+        return len(self.interfaces)
+
+    def load_ip_addresses(self, **filters):
+        """Index IP addresses by address"""
+        for ip_obj in self.nb.ipam.ip_addresses.filter(**filters):
+            self.add_ip_address(ip_obj)
+        return len(self.ip_addresses)
+
+    def load_cluster(self, cluster_id, subnets=None, client=None):
+        """Load VMs, interfaces and IPs belonging to a virtualization cluster
+
+        With an AsyncNetBox client the three list calls run concurrently.
+        """
+        if client:
+            requests = [
+                client.list('virtual_machines', cluster_id=cluster_id),
+                client.list('vm_interfaces', cluster_id=cluster_id),
+            ]
+            if subnets:
+                requests.append(client.list('ip_addresses', parent=list(subnets)))
+            results = client.gather(*requests)
+            for vm in results[0]:
+                self.add_vm(vm)
+            for interface in results[1]:
+                self.add_vm_interface(interface)
+            for ip_obj in results[2] if subnets else []:
+                self.add_ip_address(ip_obj)
+        else:
+            self.load_virtual_machines(cluster_id=cluster_id)
+            self.load_vm_interfaces(cluster_id=cluster_id)
+            if subnets:
+                self.load_ip_addresses(parent=list(subnets))
+        print(f"  ✓ Loaded snapshot: {len(self.vms)} VMs, "
+              f"{len(self.vm_interfaces)} interfaces, {len(self.ip_addresses)} IPs")
+
+    def get_vm(self, name):
+        return self.vms.get(name)
+
+    def get_device(self, name):
+        return self.devices.get(name)
+
+    def get_vm_interface(self, vm_id, name):
+        return self.vm_interfaces.get((vm_id, name))
+
+    def get_interface(self, device_id, name):
+        return self.interfaces.get((device_id, name))
+
+    def get_ip_address(self, address):
+        return self.ip_addresses.get(address)
+
+    def get_vlan(self, vid):
+        return self.vlans.get(vid)
+
+    def get_prefix(self, prefix):
+        return self.prefixes.get(prefix)
+
+    def get_ip_by_host(self, address):
+        """Return an IP with the same host address, whatever its prefix length"""
+        return self.ip_hosts.get(str(address).split('/')[0])
+
+    def get_assigned_ip(self, object_type, object_id, address):
+        """Return the IP with this address assigned to the given interface"""
+        return self.assigned_ips.get((object_type, object_id, address))
+
+    def add_vm(self, vm):
+        self.vms[vm.name] = vm
+
+    def add_device(self, device):
+        self.devices[device.name] = device
+
+    def add_vm_interface(self, interface):
+        vm_id = interface.virtual_machine.id if interface.virtual_machine else None
+        self.vm_interfaces[(vm_id, interface.name)] = interface
+
+    def add_interface(self, interface):
+        self.interfaces[(interface.device.id, interface.name)] = interface
+
+    def add_vlan(self, vlan):
+        self.vlans[vlan.vid] = vlan
+
+    def add_prefix(self, prefix):
+        self.prefixes[prefix.prefix] = prefix
+
+    def add_ip_address(self, ip_obj):
+        self.ip_addresses[ip_obj.address] = ip_obj
+        self.ip_hosts[str(ip_obj.address).split('/')[0]] = ip_obj
+        if ip_obj.assigned_object_id:
+            self.assigned_ips[(ip_obj.assigned_object_type, ip_obj.assigned_object_id, ip_obj.address)] = ip_obj
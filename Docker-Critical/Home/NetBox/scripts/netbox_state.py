@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Sync State Store
+Remembers a fingerprint of each synced source object and the NetBox ID it maps
+to, so unchanged objects can skip NetBox entirely on the next run
+
+Every source shares one database, so the connection autocommits and writes are
+grouped into short batch() transactions; the write lock is never held for a run.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Configuration
+SYNC_CACHE_DIR = os.getenv('SYNC_CACHE_DIR', os.path.expanduser('~/.cache/netbox-sync'))
+SYNC_FULL_VERIFY_INTERVAL = int(os.getenv('SYNC_FULL_VERIFY_INTERVAL', '86400'))
+SYNC_FULL_VERIFY = os.getenv('SYNC_FULL_VERIFY', 'false').lower() == 'true'
+
+
+def fingerprint(payload):
+    """Stable hash of a normalized source payload"""
+    data = json.dumps(payload, sort_keys=True, default=str, separators=(',', ':'))
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+class FingerprintStore:
+    """SQLite-backed fingerprints keyed by (source, object type, natural key)"""
+
+    def __init__(self, source, path=None):
+        self.source = source
+        self.path = path or os.path.join(SYNC_CACHE_DIR, 'sync_state.db')
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        # WAL lets one source read while another commits a batch
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS objects (
+                source TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                key TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                netbox_id INTEGER,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (source, kind, key)
+            )
+        """)
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS verifications (
+                source TEXT PRIMARY KEY,
+                verified_at REAL NOT NULL
+            )
+        """)
+        self.full_verify = SYNC_FULL_VERIFY or self._verify_due()
+        self.skipped = 0
+        if self.full_verify:
+            print(f"  Full verification pass for {source}: fingerprints are ignored this run")
+
+    def _verify_due(self):
+        row = self.db.execute(
+            "SELECT verified_at FROM verifications WHERE source = ?", (self.source,)
+        ).fetchone()
+        return not row or time.time() - row[0] >= SYNC_FULL_VERIFY_INTERVAL
+
+    def unchanged(self, kind, key, payload):
+        """True if the payload matches the last successfully synced fingerprint"""
+        if self.full_verify:
+            return False
+        row = self.db.execute(
+            "SELECT fingerprint FROM objects WHERE source = ? AND kind = ? AND key = ?",
+            (self.source, kind, str(key))
+        ).fetchone()
+        if row and row[0] == fingerprint(payload):
+            self.skipped += 1
+            return True
+        return False
+
+    def netbox_id(self, kind, key):
+        row = self.db.execute(
+            "SELECT netbox_id FROM objects WHERE source = ? AND kind = ? AND key = ?",
+            (self.source, kind, str(key))
+        ).fetchone()
+        return row[0] if row else None
+
+    def record(self, kind, key, payload, netbox_id=None):
+        """Remember a payload once it has been written to NetBox"""
+        self.db.execute(
+            "INSERT OR REPLACE INTO objects VALUES (?, ?, ?, ?, ?, ?)",
+            (self.source, kind, str(key), fingerprint(payload), netbox_id, time.time())
+        )
+
+    @contextmanager
+    def batch(self):
+        """Write the records that follow one bulk flush in a single short transaction"""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    def forget(self, kind, key):
+        self.db.execute(
+            "DELETE FROM objects WHERE source = ? AND kind = ? AND key = ?",
+            (self.source, kind, str(key))
+        )
+
+    def forget_netbox_ids(self, kind, netbox_ids):
+        """Drop fingerprints of objects deleted from NetBox, looked up by their NetBox ID"""
+        self.db.executemany(
+            "DELETE FROM objects WHERE source = ? AND kind = ? AND netbox_id = ?",
+            [(self.source, kind, netbox_id) for netbox_id in netbox_ids]
+        )
+
+    def commit(self):
+        """Close out a full verification pass; fingerprints are already committed per batch"""
+        if self.full_verify:
+            self.db.execute(
+                "INSERT OR REPLACE INTO verifications VALUES (?, ?)", (self.source, time.time())
+            )
+            self.full_verify = False
+        if self.skipped:
+            print(f"  Skipped {self.skipped} unchanged {self.source} objects")
+            self.skipped = 0
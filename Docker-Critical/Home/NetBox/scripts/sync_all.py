@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Parallel NetBox Sync Runner
+Runs the TrueNAS, OPNsense, Omada and Docker syncs concurrently with a shared
+NetBox request limit and per-source timeouts
+"""
+
+import importlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import sys
+import time
+
+# Configuration
+NETBOX_MAX_CONCURRENCY = int(os.getenv('NETBOX_MAX_CONCURRENCY', '8'))
+SYNC_TIMEOUT = int(os.getenv('SYNC_TIMEOUT', '900'))
+SYNC_LOG_DIR = os.getenv('SYNC_LOG_DIR', '')
+SYNC_STOP_GRACE = int(os.getenv('SYNC_STOP_GRACE', '10'))
+
+# source name -> (module, class)
+SOURCES = {
+    'truenas': ('sync_truenas', 'TrueNASSync'),
+    'opnsense': ('sync_opnsense', 'OPNsenseSync'),
+    'omada': ('sync_omada', 'OmadaSync'),
+    'docker': ('sync_docker', 'DockerSync'),
+}
+
+
+def source_timeout(name):
+    """Per-source timeout, e.g. SYNC_TIMEOUT_DOCKER=300"""
+    return int(os.getenv(f'SYNC_TIMEOUT_{name.upper()}', SYNC_TIMEOUT))
+
+
+def limit_netbox_requests(nb, semaphore):
+    """Make every request on the pynetbox session, AsyncNetBox included, hold the shared semaphore"""
+    request = nb.http_session.request
+
+    def limited(*args, **kwargs):
+        with semaphore:
+            return request(*args, **kwargs)
+
+    nb.http_session.request = limited
+
+
+def stop_on_sigterm(signum, frame):
+    """Turn a timeout's SIGTERM into SystemExit so held semaphore permits are released"""
+    raise SystemExit(128 + signum)
+
+
+def run_source(name, semaphore):
+    """Child process entry point: run one sync class and exit with its result"""
+    signal.signal(signal.SIGTERM, stop_on_sigterm)
+    if SYNC_LOG_DIR:
+        log = open(os.path.join(SYNC_LOG_DIR, f'sync_{name}.log'), 'a', buffering=1)
+        sys.stdout = sys.stderr = log
+    module_name, class_name = SOURCES[name]
+    sync = getattr(importlib.import_module(module_name), class_name)()
+    limit_netbox_requests(sync.nb, semaphore)
+    success = sync.run()
+    sys.stdout.flush()
+    sys.exit(0 if success else 1)
+
+
+def run_all(names):
+    """Run the given sources concurrently; returns {name: (status, seconds)}"""
+    semaphore = multiprocessing.BoundedSemaphore(NETBOX_MAX_CONCURRENCY)
+    procs = {}
+    for name in names:
+        proc = multiprocessing.Process(target=run_source, args=(name, semaphore), name=f'sync-{name}')
+        proc.start()
+        procs[name] = (proc, time.monotonic(), source_timeout(name))
+
+    results = {}
+    while len(results) < len(procs):
+        now = time.monotonic()
+        for name, (proc, started, timeout) in procs.items():
+            if name in results:
+                continue
+            if not proc.is_alive():
+                results[name] = ('ok' if proc.exitcode == 0 else f'failed ({proc.exitcode})', now - started)
+            elif now - started > timeout:
+                proc.terminate()
+                proc.join(SYNC_STOP_GRACE)
+                if proc.is_alive():
+                    proc.kill()
+                    proc.join()
+                results[name] = ('timeout', now - started)
+        pending = [proc.sentinel for name, (proc, _, _) in procs.items() if name not in results]
+        if pending:
+            multiprocessing.connection.wait(pending, timeout=1)
+    return results
+
+
+def main(argv):
+    names = argv or list(SOURCES)
+    unknown = [name for name in names if name not in SOURCES]
+    if unknown:
+        print(f"✗ Unknown sources: {', '.join(unknown)} (choose from {', '.join(SOURCES)})")
+        return 2
+
+    print(f"Starting parallel sync: {', '.join(names)} (NetBox concurrency {NETBOX_MAX_CONCURRENCY})")
+    started = time.monotonic()
+    results = run_all(names)
+
+    print("\n=== Sync Summary ===")
+    for name in names:
+        status, seconds = results[name]
+        mark = '✓' if status == 'ok' else '✗'
+        print(f"  {mark} {name:<10} {status:<12} {seconds:7.1f}s")
+    print(f"  Total wall time: {time.monotonic() - started:.1f}s")
+
+    return 0 if all(status == 'ok' for status, _ in results.values()) else 1
+
+
+if __name__ == '__main__':
+    exit(main(sys.argv[1:]))
@@ -2,238 +2,589 @@
 """
 Docker to NetBox Sync Script
 Syncs Docker containers, images, networks, and volumes to NetBox
+
+Run with --watch to stay running and sync incrementally from Docker events
 """
 
 import docker
 import pynetbox
+import json
 import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from netbox_snapshot import NetBoxSnapshot
+from netbox_prefixes import PrefixIndex, PrefixIntervals, plan_prefixes, relation_note
+from netbox_bulk import BulkWriter, Pending, ref
+from netbox_diff import SyncStats, apply_changes
+from netbox_resolver import ReferenceResolver
+from netbox_async import AsyncNetBox
+from netbox_state import FingerprintStore
+from netbox_prune import Pruner, claim, owner_tag
 
 # Configuration
 NETBOX_URL = os.getenv('NETBOX_URL', 'http://localhost:8080')
 NETBOX_TOKEN = os.getenv('NETBOX_TOKEN', '')
 DOCKER_HOST = os.getenv('DOCKER_HOST', 'truenas01')
 DOCKER_SITE = os.getenv('DOCKER_SITE', 'homelab')
+DOCKER_EVENT_DEBOUNCE = float(os.getenv('DOCKER_EVENT_DEBOUNCE', '2'))
+
+# Comma-separated name=url pairs, e.g.
+# docker-critical=unix:///var/run/docker.sock,docker-noncritical=tcp://10.0.0.6:2375
+# Each name is used as the host's NetBox cluster and host device. When unset, the
+# local daemon from the environment is synced as DOCKER_HOST.
+DOCKER_ENDPOINTS = os.getenv('DOCKER_ENDPOINTS', '')
+
+# Optional usage stats (memory_usage_mb / cpu_percent custom fields); each stats
+# call blocks for a couple of seconds, so results are reused for DOCKER_STATS_INTERVAL
+DOCKER_COLLECT_STATS = os.getenv('DOCKER_COLLECT_STATS', 'false').lower() == 'true'
+DOCKER_STATS_INTERVAL = int(os.getenv('DOCKER_STATS_INTERVAL', '900'))
+DOCKER_STATS_WORKERS = int(os.getenv('DOCKER_STATS_WORKERS', '8'))
+DOCKER_STATS_TIMEOUT = int(os.getenv('DOCKER_STATS_TIMEOUT', '10'))
+SYNC_CACHE_DIR = os.getenv('SYNC_CACHE_DIR', os.path.expanduser('~/.cache/netbox-sync'))
+
+# Above this many changed containers, prefetch the whole cluster instead of by name
+INCREMENTAL_LOOKUP_LIMIT = 50
+
+# Docker events that change what we record in NetBox
+WATCHED_EVENTS = {
+    'container': ['create', 'start', 'die', 'destroy'],
+    'network': ['create', 'destroy', 'connect', 'disconnect'],
+    'volume': ['create', 'destroy'],
+}
+
+def parse_endpoints(value):
+    """Parse DOCKER_ENDPOINTS into (name, url) pairs"""
+    endpoints = []
+    for entry in value.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, _, url = entry.partition('=')
+        if not name.strip() or not url.strip():
+            raise ValueError(f"Invalid DOCKER_ENDPOINTS entry {entry!r}, expected name=url")
+        endpoints.append((name.strip(), url.strip()))
+    return endpoints
+
+class DockerHost:
+    """One Docker daemon and the NetBox cluster/host device it is recorded under"""
+    
+    def __init__(self, name, client, url=None):
+        self.name = name
+        self.client = client
+        self.url = url
+        self._stats_api = None
+    
+    @property
+    def stats_api(self):
+        """Separate low-level client whose request timeout bounds each stats call"""
+        if self._stats_api is None:
+            if self.url:
+                self._stats_api = docker.APIClient(base_url=self.url, timeout=DOCKER_STATS_TIMEOUT)
+            else:
+                self._stats_api = docker.from_env(timeout=DOCKER_STATS_TIMEOUT).api
+        return self._stats_api
+    
+    def __repr__(self):
+        return self.name
+
+class HostInventory:
+    """What was read from one Docker host, ready for the NetBox write phase
+    
+    A partial inventory (from Docker events) only names the objects that changed.
+    """
+    
+    def __init__(self, host, networks=None, containers=None, volumes=None, info=None, partial=False):
+        self.host = host
+        self.networks = networks or []
+        self.containers = containers or []
+        self.volumes = volumes
+        self.info = info
+        self.partial = partial
+        self.stats = {}
+
+class ContainerInfo:
+    """Container built from the low-level list output joined with the image list"""
+    
+    def __init__(self, api, summary, image_tags):
+        self.api = api
+        self.id = summary['Id']
+        self.short_id = self.id[:12]
+        self.name = summary['Names'][0].lstrip('/')
+        self.status = summary.get('State', 'unknown')
+        self.labels = summary.get('Labels') or {}
+        self.networks = summary.get('NetworkSettings', {}).get('Networks') or {}
+        self.image = image_tags[0] if image_tags else 'unknown'
+        self._host_config = None
+    
+    @property
+    def host_config(self):
+        """Resource limits are not in the list output; inspect only when they are needed"""
+        if self._host_config is None:
+            self._host_config = self.api.inspect_container(self.id).get('HostConfig') or {}
+        return self._host_config
+
+class ContainerStats:
+    """Usage snapshots from the stats API, cached on disk between runs"""
+    
+    def __init__(self, cache_file=None, interval=DOCKER_STATS_INTERVAL, workers=DOCKER_STATS_WORKERS):
+        self.cache_file = cache_file or os.path.join(SYNC_CACHE_DIR, 'docker_stats.json')
+        self.interval = interval
+        self.workers = max(1, workers)
+        self.cache = self._load()
+        self.lock = threading.Lock()
+        self.dirty = False
+    
+    def _load(self):
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
+    def save(self):
+        """Persist collected stats, dropping entries that are too old to reuse"""
+        if not self.dirty:
+            return
+        now = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+            with self.lock:
+                entries = {k: v for k, v in self.cache.items() if now - v['ts'] < self.interval}
+            tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.cache_file)
+            self.dirty = False
+        except OSError as e:
+            print(f"  ✗ Could not write container stats cache: {e}")
+    
+    def collect(self, host, containers):
+        """Return {container name: usage} for running containers, fetching only stale entries"""
+        now = time.time()
+        usage = {}
+        stale = []
+        for container in containers:
+            if container.status != 'running':
+                continue
+            entry = self.cache.get(f"{host.name}/{container.name}")
+            if entry and entry['id'] == container.id and now - entry['ts'] < self.interval:
+                usage[container.name] = entry['usage']
+            else:
+                stale.append(container)
+        if not stale:
+            return usage
+        
+        # Each call samples twice a second apart; the client timeout bounds stuck calls
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(stale))) as pool:
+            futures = [(container, pool.submit(host.stats_api.stats, container.id, stream=False))
+                       for container in stale]
+        failed = 0
+        for container, future in futures:
+            try:
+                usage[container.name] = self.summarize(future.result())
+            except Exception:
+                failed += 1
+                continue
+            with self.lock:
+                self.cache[f"{host.name}/{container.name}"] = {
+                    'id': container.id,
+                    'ts': now,
+                    'usage': usage[container.name]
+                }
+            self.dirty = True
+        print(f"  ✓ Collected stats for {len(stale) - failed} containers on {host.name}")
+        if failed:
+            print(f"  ✗ Stats failed or timed out for {failed} containers on {host.name}")
+        return usage
+    
+    def summarize(self, stats):
+        """Memory in use (excluding page cache) and CPU percent, as docker stats reports them"""
+        memory = stats.get('memory_stats') or {}
+        memory_detail = memory.get('stats') or {}
+        page_cache = memory_detail.get('inactive_file', memory_detail.get('cache', 0))
+        memory_used = max(memory.get('usage', 0) - page_cache, 0)
+        
+        cpu = stats.get('cpu_stats') or {}
+        precpu = stats.get('precpu_stats') or {}
+        cpu_delta = cpu.get('cpu_usage', {}).get('total_usage', 0) - precpu.get('cpu_usage', {}).get('total_usage', 0)
+        system_delta = cpu.get('system_cpu_usage', 0) - precpu.get('system_cpu_usage', 0)
+        online_cpus = cpu.get('online_cpus') or len(cpu.get('cpu_usage', {}).get('percpu_usage') or []) or 1
+        cpu_percent = cpu_delta / system_delta * online_cpus * 100 if cpu_delta > 0 and system_delta > 0 else 0.0
+        
+        return {
+            'memory_usage_mb': memory_used // (1024 * 1024),
+            'cpu_percent': round(cpu_percent, 1)
+        }
 
 class DockerSync:
-    def __init__(self):
+    def __init__(self, endpoints=None):
         try:
-            self.docker_client = docker.from_env()
+            if endpoints is None:
+                endpoints = parse_endpoints(DOCKER_ENDPOINTS)
+            if endpoints:
+                self.hosts = [DockerHost(name, docker.DockerClient(base_url=url), url) for name, url in endpoints]
+            else:
+                self.hosts = [DockerHost(DOCKER_HOST, docker.from_env())]
             self.nb = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
             self.nb.http_session.verify = False
+            self.resolver = ReferenceResolver(self.nb)
+            self.nb_async = AsyncNetBox(self.nb)
+            self.netbox_prefixes = None
+            self.state = FingerprintStore('docker')
+            self.stats = ContainerStats() if DOCKER_COLLECT_STATS else None
         except Exception as e:
             print(f"✗ Error initializing Docker client: {e}")
             raise
     
     def ensure_manufacturer(self):
         """Ensure Docker manufacturer exists"""
-        manufacturer = self.nb.dcim.manufacturers.get(name='Docker')
-        if not manufacturer:
-            manufacturer = self.nb.dcim.manufacturers.create(
-                name='Docker',
-                slug='docker'
-            )
-        return manufacturer
+        return self.resolver.manufacturer('Docker', slug='docker')
     
     def ensure_site(self):
         """Ensure site exists"""
-        site = self.nb.dcim.sites.get(name=DOCKER_SITE)
-        if not site:
-            site = self.nb.dcim.sites.create(
-                name=DOCKER_SITE,
-                slug=DOCKER_SITE.lower()
-            )
-        return site
+        return self.resolver.site(DOCKER_SITE, slug=DOCKER_SITE.lower())
     
     def ensure_device_role(self, name, color='9c27b0'):
         """Ensure device role exists"""
-        role = self.nb.dcim.device_roles.get(name=name)
-        if not role:
-            role = self.nb.dcim.device_roles.create(
-                name=name,
-                slug=name.lower().replace(' ', '-'),
-                color=color
-            )
-        return role
+        return self.resolver.device_role(name, color=color)
     
     def ensure_device_type(self, manufacturer, model):
         """Ensure device type exists"""
-        device_type = self.nb.dcim.device_types.get(model=model)
-        if not device_type:
-            device_type = self.nb.dcim.device_types.create(
-                manufacturer=manufacturer.id,
-                model=model,
-                slug=model.lower().replace(' ', '-')
-            )
-        return device_type
-    
-    def ensure_host_device(self):
+        return self.resolver.device_type(manufacturer, model)
+    
+    def ensure_host_device(self, host):
         """Ensure Docker host device exists in NetBox"""
         site = self.ensure_site()
         role = self.ensure_device_role('container-host', color='9c27b0')
         manufacturer = self.ensure_manufacturer()
         device_type = self.ensure_device_type(manufacturer, 'Docker Host')
         
-        device = self.nb.dcim.devices.get(name=DOCKER_HOST)
-        if not device:
-            device = self.nb.dcim.devices.create(
-                name=DOCKER_HOST,
-                device_type=device_type.id,
-                role=role.id,
-                site=site.id,
-                status='active'
-            )
-            print(f"  ✓ Created Docker host device: {DOCKER_HOST}")
+        return self.resolver.device(
+            host.name,
+            device_type=device_type,
+            role=role,
+            site=site,
+            status='active'
+        )
+    
+    def ensure_owner_tag(self):
+        """Ensure the tag marking objects this sync created exists"""
+        return owner_tag(self.resolver, 'docker')
+    
+    def ensure_cluster(self, host):
+        """Ensure the virtualization cluster for a Docker host exists"""
+        cluster_type = self.resolver.cluster_type('Docker', slug='docker')
+        return self.resolver.cluster(host.name, cluster_type, site=self.ensure_site())
+    
+    def enumerate_host(self, host):
+        """Read everything the write phase needs from one Docker host"""
+        inventory = HostInventory(
+            host,
+            networks=host.client.networks.list(),
+            containers=self.list_containers(host),
+            volumes=host.client.volumes.list(),
+            info=host.client.info()
+        )
+        if self.stats:
+            inventory.stats = self.stats.collect(host, inventory.containers)
+        return inventory
+    
+    def enumerate_hosts(self):
+        """Enumerate every Docker host concurrently; returns (inventories, failed host names)"""
+        with ThreadPoolExecutor(max_workers=len(self.hosts)) as pool:
+            futures = [(host, pool.submit(self.enumerate_host, host)) for host in self.hosts]
         
-        return device
+        inventories = []
+        failed = []
+        for host, future in futures:
+            try:
+                inventory = future.result()
+            except Exception as e:
+                print(f"✗ Error reading Docker host {host.name}: {e}")
+                failed.append(host.name)
+                continue
+            info = inventory.info
+            print(f"✓ Connected to Docker on {host.name}: {info['Name']}")
+            print(f"  Containers: {info['Containers']} ({info['ContainersRunning']} running)")
+            print(f"  Images: {info['Images']}")
+            inventories.append(inventory)
+        return inventories, failed
     
-    def sync_networks(self):
+    def sync_networks(self, inventories):
         """Sync Docker networks to NetBox VLANs/prefixes"""
         print("\n=== Syncing Docker Networks ===")
         
         try:
-            networks = self.docker_client.networks.list()
+            stats = SyncStats('Prefixes')
+            vlan_group = self.resolver.vlan_group('Docker Networks', slug='docker-networks')
             
-            for network in networks:
-                name = network.name
-                network_id = network.short_id
-                driver = network.attrs.get('Driver', 'unknown')
-                scope = network.attrs.get('Scope', 'local')
-                
-                # Skip default bridge/host/none networks unless they have containers
-                if name in ['bridge', 'host', 'none'] and not network.attrs.get('Containers'):
-                    continue
-                
-                ipam_config = network.attrs.get('IPAM', {}).get('Config', [])
-                
-                print(f"  Network: {name} ({driver}, {scope})")
-                
-                # Create VLAN in NetBox
-                vlan_group = self.nb.ipam.vlan_groups.get(name='Docker Networks')
-                if not vlan_group:
-                    vlan_group = self.nb.ipam.vlan_groups.create(
-                        name='Docker Networks',
-                        slug='docker-networks'
-                    )
-                
-                # For each subnet in the network
-                for config in ipam_config:
-                    subnet = config.get('Subnet')
-                    gateway = config.get('Gateway')
+            # Hosts can reuse the same subnet, so collect the networks behind each one first
+            subnets = {}
+            for inventory in inventories:
+                for network in inventory.networks:
+                    name = network.name
+                    driver = network.attrs.get('Driver', 'unknown')
+                    scope = network.attrs.get('Scope', 'local')
+                    
+                    # Skip default bridge/host/none networks unless they have containers
+                    if name in ['bridge', 'host', 'none'] and not network.attrs.get('Containers'):
+                        continue
                     
-                    if subnet:
-                        # Create or update prefix
-                        prefix = self.nb.ipam.prefixes.get(prefix=subnet)
-                        if not prefix:
-                            prefix = self.nb.ipam.prefixes.create(
-                                prefix=subnet,
-                                status='active',
-                                description=f"Docker network: {name} ({driver})"
-                            )
-                            print(f"    ✓ Created prefix: {subnet}")
-                        else:
-                            prefix.description = f"Docker network: {name} ({driver})"
-                            prefix.save()
-                            print(f"    ✓ Updated prefix: {subnet}")
+                    ipam_config = network.attrs.get('IPAM', {}).get('Config') or []
+                    
+                    print(f"  Network: {name} ({driver}, {scope}) on {inventory.host.name}")
+                    
+                    for config in ipam_config:
+                        subnet = config.get('Subnet')
+                        if subnet:
+                            label = f"{name} ({driver})"
+                            if label not in subnets.setdefault(subnet, []):
+                                subnets[subnet].append(label)
+            
+            if not subnets:
+                print(f"  {stats.summary()}")
+                return
+            
+            # Exact matches, nesting and overlaps are checked against the prefixes read this run
+            creates, matches, conflicts = plan_prefixes(self.prefix_intervals(), subnets)
+            
+            for subnet, duplicates in conflicts:
+                print(f"    ✗ Skipped prefix {subnet}: {len(duplicates)} copies already exist in the global VRF")
+            
+            writer = BulkWriter()
+            tag = self.ensure_owner_tag()
+            
+            queued = {}
+            for subnet, relation, related in creates:
+                queued[subnet] = writer.create(self.nb.ipam.prefixes, {
+                    'prefix': subnet,
+                    'status': 'active',
+                    'description': f"Docker network: {', '.join(subnets[subnet])}",
+                    'tags': [tag.id]
+                })
+                stats.created += 1
+                print(f"    ✓ Queued prefix: {subnet}{relation_note(relation, related)}")
+            for subnet, prefix in matches:
+                if prefix is None:
+                    # Queued by an earlier event batch whose write never completed
+                    continue
+                description = f"Docker network: {', '.join(subnets[subnet])}"
+                if apply_changes(prefix, claim(prefix, tag, {'description': description}), stats, writer):
+                    print(f"    ✓ Updated prefix: {subnet}")
+            
+            writer.flush()
+            # Later event batches match these subnets against the created records
+            for subnet, pending in queued.items():
+                self.netbox_prefixes.set_record(subnet, pending.record)
+            print(f"  {stats.summary()}")
         
         except Exception as e:
             print(f"  ✗ Error syncing networks: {e}")
+            # Queued prefixes may not exist; read them again rather than trust placeholders
+            self.netbox_prefixes = None
     
-    def sync_containers(self):
+    def sync_containers(self, inventories):
         """Sync Docker containers as virtual machines in NetBox"""
         print("\n=== Syncing Docker Containers ===")
         
         try:
-            containers = self.docker_client.containers.list(all=True)
-            site = self.ensure_site()
-            host_device = self.ensure_host_device()
-            
-            # Ensure cluster exists for containers
-            cluster_type = self.nb.virtualization.cluster_types.get(name='Docker')
-            if not cluster_type:
-                cluster_type = self.nb.virtualization.cluster_types.create(
-                    name='Docker',
-                    slug='docker'
-                )
+            stats = SyncStats('Container VMs')
+            writer = BulkWriter()
+            synced = {}
+            payloads = {}
+            tag = self.ensure_owner_tag()
             
-            cluster = self.nb.virtualization.clusters.get(name=DOCKER_HOST)
-            if not cluster:
-                cluster = self.nb.virtualization.clusters.create(
-                    name=DOCKER_HOST,
-                    type=cluster_type.id,
-                    site=site.id
-                )
-            
-            for container in containers:
-                name = container.name
-                container_id = container.short_id
-                status_map = {
-                    'running': 'active',
-                    'exited': 'offline',
-                    'paused': 'staged',
-                    'restarting': 'staged',
-                    'created': 'staged'
-                }
-                status = status_map.get(container.status, 'offline')
+            # One writer for every host, so all hosts share a single bulk write phase
+            for inventory in inventories:
+                host = inventory.host
+                containers = inventory.containers
+                self.ensure_host_device(host)
+                cluster = self.ensure_cluster(host)
                 
-                # Get container details
-                image = container.image.tags[0] if container.image.tags else 'unknown'
-                labels = container.labels
-                networks = list(container.attrs['NetworkSettings']['Networks'].keys())
-                
-                # Extract resource limits if set
-                memory_limit = container.attrs['HostConfig'].get('Memory', 0)
-                cpu_quota = container.attrs['HostConfig'].get('CpuQuota', 0)
-                
-                # Calculate approximate vCPUs (Docker uses 100000 as 1 CPU)
-                vcpus = max(1, cpu_quota // 100000) if cpu_quota > 0 else 1
-                
-                # Convert memory to MB
-                memory_mb = memory_limit // (1024 * 1024) if memory_limit > 0 else 512
-                
-                # Get or create VM
-                vm = self.nb.virtualization.virtual_machines.get(name=name)
-                
-                comments = f"Container ID: {container_id}\nImage: {image}\nNetworks: {', '.join(networks)}"
-                if labels:
-                    comments += f"\nLabels: {len(labels)} labels"
+                # Skip containers whose fingerprint matches the last successful sync
+                changed = []
+                for container in containers:
+                    key = f"{host.name}/{container.name}"
+                    payloads[key] = self.container_payload(container, inventory.stats.get(container.name))
+                    if self.state.unchanged('container', key, payloads[key]):
+                        stats.unchanged += 1
+                    else:
+                        changed.append(container)
+                if not changed:
+                    continue
                 
-                if not vm:
-                    vm = self.nb.virtualization.virtual_machines.create(
-                        name=name,
-                        cluster=cluster.id,
-                        status=status,
-                        vcpus=vcpus,
-                        memory=memory_mb,
-                        comments=comments,
-                        custom_fields={
-                            'container_id': container_id,
-                            'image': image
-                        } if self.has_custom_fields() else {}
-                    )
-                    print(f"  ✓ Created container VM: {name} ({status})")
+                # Prefetch existing VMs, interfaces and IPs for this host's cluster
+                snapshot = NetBoxSnapshot(self.nb)
+                if (inventory.partial or len(changed) < len(containers)) and len(changed) <= INCREMENTAL_LOOKUP_LIMIT:
+                    self.load_container_snapshot(snapshot, cluster, changed)
                 else:
-                    # Update existing VM
-                    vm.status = status
-                    vm.vcpus = vcpus
-                    vm.memory = memory_mb
-                    vm.comments = comments
-                    if self.has_custom_fields():
-                        vm.custom_fields['container_id'] = container_id
-                        vm.custom_fields['image'] = image
-                    vm.save()
-                    print(f"  ✓ Updated container VM: {name} ({status})")
+                    snapshot.load_cluster(cluster.id, subnets=self.get_docker_subnets(inventory),
+                                          client=self.nb_async)
+                prefixes = self.prefix_index(inventory, self.prefix_intervals())
                 
-                # Sync container network interfaces
-                self.sync_container_interfaces(vm, container)
+                for container in changed:
+                    name = container.name
+                    container_id = container.short_id
+                    status_map = {
+                        'running': 'active',
+                        'exited': 'offline',
+                        'paused': 'staged',
+                        'restarting': 'staged',
+                        'created': 'staged'
+                    }
+                    status = status_map.get(container.status, 'offline')
+                    
+                    # Get container details
+                    image = container.image
+                    labels = container.labels
+                    networks = list(container.networks.keys())
+                    
+                    # Extract resource limits if set
+                    memory_limit = container.host_config.get('Memory', 0)
+                    cpu_quota = container.host_config.get('CpuQuota', 0)
+                    
+                    # Calculate approximate vCPUs (Docker uses 100000 as 1 CPU)
+                    vcpus = max(1, cpu_quota // 100000) if cpu_quota > 0 else 1
+                    
+                    # Convert memory to MB
+                    memory_mb = memory_limit // (1024 * 1024) if memory_limit > 0 else 512
+                    
+                    # Get or create VM
+                    vm = snapshot.get_vm(name)
+                    custom_fields = {
+                        'container_id': container_id,
+                        'image': image,
+                        **inventory.stats.get(name, {})
+                    }
+                    
+                    comments = f"Container ID: {container_id}\nImage: {image}\nNetworks: {', '.join(networks)}"
+                    if labels:
+                        comments += f"\nLabels: {len(labels)} labels"
+                    
+                    if not vm:
+                        vm = writer.create(self.nb.virtualization.virtual_machines, {
+                            'name': name,
+                            'cluster': cluster.id,
+                            'status': status,
+                            'vcpus': vcpus,
+                            'memory': memory_mb,
+                            'comments': comments,
+                            'custom_fields': custom_fields if self.has_custom_fields() else {},
+                            'tags': [tag.id]
+                        }, key=f"{host.name}/{name}")
+                        stats.created += 1
+                        print(f"  ✓ Queued container VM: {name} on {host.name} ({status})")
+                    else:
+                        # Update existing VM
+                        desired = {
+                            'status': status,
+                            'vcpus': vcpus,
+                            'memory': memory_mb,
+                            'comments': comments
+                        }
+                        if self.has_custom_fields():
+                            desired['custom_fields'] = custom_fields
+                        if apply_changes(vm, claim(vm, tag, desired), stats, writer):
+                            print(f"  ✓ Updated container VM: {name} on {host.name} ({status})")
+                    
+                    # Sync container network interfaces
+                    if self.sync_container_interfaces(vm, container, snapshot, writer, tag, prefixes):
+                        synced[f"{host.name}/{name}"] = vm
+            
+            created, updated = writer.flush()
+            if created or updated:
+                print(f"  ✓ Wrote {created} new and {updated} updated objects in bulk")
+            
+            with self.state.batch():
+                for key, vm in synced.items():
+                    self.state.record('container', key, payloads[key], netbox_id=vm.id)
+            print(f"  {stats.summary()}")
         
         except Exception as e:
             print(f"  ✗ Error syncing containers: {e}")
     
-    def sync_container_interfaces(self, vm, container):
+    def list_containers(self, host, filters=None):
+        """Enumerate containers with one list call and one image list call"""
+        api = host.client.api
+        summaries = api.containers(all=True, filters=filters)
+        image_tags = {
+            image['Id']: [tag for tag in image.get('RepoTags') or [] if tag != '<none>:<none>']
+            for image in api.images()
+        }
+        return [
+            ContainerInfo(api, summary, image_tags.get(summary.get('ImageID'), []))
+            for summary in summaries
+        ]
+    
+    def container_payload(self, container, usage=None):
+        """Normalized view of a container from the list call alone (limits need an inspect)"""
+        return {
+            'usage': usage,
+            'id': container.short_id,
+            'status': container.status,
+            'image': container.image,
+            'labels': len(container.labels),
+            'networks': {
+                net_name: [net_config.get('IPAddress'), net_config.get('MacAddress')]
+                for net_name, net_config in container.networks.items()
+            },
+        }
+    
+    def load_container_snapshot(self, snapshot, cluster, containers):
+        """Load only the NetBox objects for the given containers"""
+        names = [container.name for container in containers]
+        addresses = [
+            config['IPAddress']
+            for container in containers
+            for config in container.networks.values()
+            if config.get('IPAddress')
+        ]
+        snapshot.load_virtual_machines(cluster_id=cluster.id, name=names)
+        snapshot.load_vm_interfaces(cluster_id=cluster.id, virtual_machine=names)
+        if addresses:
+            snapshot.load_ip_addresses(address=addresses)
+    
+    def mark_containers_removed(self, host, names):
+        """Set VMs for destroyed containers offline"""
+        cluster = self.ensure_cluster(host)
+        for vm in self.nb.virtualization.virtual_machines.filter(cluster_id=cluster.id, name=names):
+            self.state.forget('container', f"{host.name}/{vm.name}")
+            if apply_changes(vm, {'status': 'offline'}):
+                print(f"  ✓ Marked removed container offline: {vm.name} on {host.name}")
+    
+    def get_docker_subnets(self, inventory):
+        """Collect subnets from a host's Docker network IPAM configs"""
+        subnets = set()
+        for network in inventory.networks:
+            for config in network.attrs.get('IPAM', {}).get('Config') or []:
+                if config.get('Subnet'):
+                    subnets.add(config['Subnet'])
+        return subnets
+    
+    def prefix_intervals(self):
+        """NetBox prefixes, read once per full run and extended with the prefixes this sync queues"""
+        if self.netbox_prefixes is None:
+            self.netbox_prefixes = PrefixIntervals()
+            count = self.netbox_prefixes.load(self.nb)
+            print(f"  ✓ Loaded {count} NetBox prefixes")
+        return self.netbox_prefixes
+    
+    def prefix_index(self, inventory, netbox_prefixes):
+        """Longest-prefix-match index of NetBox prefixes plus the host's Docker subnets"""
+        index = PrefixIndex()
+        for network, record in netbox_prefixes:
+            index.add(network, record)
+        for subnet in self.get_docker_subnets(inventory):
+            index.add(subnet)
+        return index
+    
+    def sync_container_interfaces(self, vm, container, snapshot, writer, tag, prefixes):
         """Sync container network interfaces"""
         try:
-            network_settings = container.attrs['NetworkSettings']['Networks']
+            network_settings = container.networks
             
             for net_name, net_config in network_settings.items():
                 ip_address = net_config.get('IPAddress')
@@ -243,42 +594,64 @@ class DockerSync:
                     continue
                 
                 # Get or create interface
-                interface = self.nb.virtualization.interfaces.get(
-                    virtual_machine_id=vm.id,
-                    name=net_name
-                )
+                interface = None if isinstance(vm, Pending) else snapshot.get_vm_interface(vm.id, net_name)
                 
                 if not interface:
-                    interface = self.nb.virtualization.interfaces.create(
-                        virtual_machine=vm.id,
-                        name=net_name,
-                        mac_address=mac_address if mac_address else None
-                    )
+                    interface = writer.create(self.nb.virtualization.interfaces, {
+                        'virtual_machine': ref(vm),
+                        'name': net_name,
+                        'mac_address': mac_address if mac_address else None,
+                        'tags': [tag.id]
+                    })
                 else:
-                    if mac_address and interface.mac_address != mac_address:
-                        interface.mac_address = mac_address
-                        interface.save()
+                    desired = {'mac_address': mac_address} if mac_address else {}
+                    apply_changes(interface, claim(interface, tag, desired), writer=writer)
                 
-                # Create or update IP address
-                ip_with_prefix = f"{ip_address}/16"  # Most Docker networks use /16
-                ip_obj = self.nb.ipam.ip_addresses.get(address=ip_with_prefix)
+                # Create or update IP address; the mask comes from the network's subnet,
+                # falling back to Docker's reported prefix length
+                docker_prefixlen = net_config.get('IPPrefixLen') or 16
+                ip_with_prefix = prefixes.with_prefix(ip_address, docker_prefixlen)
+                ip_obj = self.find_container_ip(snapshot, interface, ip_with_prefix)
                 
                 if not ip_obj:
-                    ip_obj = self.nb.ipam.ip_addresses.create(
-                        address=ip_with_prefix,
-                        status='active',
-                        assigned_object_type='virtualization.vminterface',
-                        assigned_object_id=interface.id,
-                        description=f"Container: {container.name}"
-                    )
+                    writer.create(self.nb.ipam.ip_addresses, {
+                        'address': ip_with_prefix,
+                        'status': 'active',
+                        'assigned_object_type': 'virtualization.vminterface',
+                        'assigned_object_id': ref(interface),
+                        'description': f"Container: {container.name}",
+                        'tags': [tag.id]
+                    })
                 else:
-                    ip_obj.assigned_object_type = 'virtualization.vminterface'
-                    ip_obj.assigned_object_id = interface.id
-                    ip_obj.description = f"Container: {container.name}"
-                    ip_obj.save()
+                    apply_changes(ip_obj, claim(ip_obj, tag, {
+                        'address': prefixes.with_prefix(ip_address, docker_prefixlen, ip_obj.address),
+                        'assigned_object_type': 'virtualization.vminterface',
+                        'assigned_object_id': ref(interface),
+                        'description': f"Container: {container.name}"
+                    }), writer=writer)
+            return True
         
         except Exception as e:
             print(f"    ✗ Error syncing interfaces for {container.name}: {e}")
+            return False
+    
+    def find_container_ip(self, snapshot, interface, address):
+        """Find the IP for a container interface without taking one owned by another host
+        
+        Separate Docker hosts hand out the same private addresses, so with more
+        than one host an address assigned outside this host's cluster is left alone.
+        """
+        if not isinstance(interface, Pending):
+            ip_obj = snapshot.get_assigned_ip('virtualization.vminterface', interface.id, address)
+            if ip_obj:
+                return ip_obj
+        # A record saved with the wrong mask is matched by host and corrected
+        ip_obj = snapshot.get_ip_address(address) or snapshot.get_ip_by_host(address)
+        if ip_obj and ip_obj.assigned_object_id and len(self.hosts) > 1:
+            local = {vm_interface.id for vm_interface in snapshot.vm_interfaces.values()}
+            if ip_obj.assigned_object_id not in local:
+                return None
+        return ip_obj
     
     def has_custom_fields(self):
         """Check if custom fields exist for VMs"""
@@ -288,59 +661,141 @@ class DockerSync:
         except:
             return False
     
-    def sync_volumes(self):
+    def sync_volumes(self, inventories):
         """Sync Docker volumes to NetBox (as comments/custom fields)"""
         print("\n=== Syncing Docker Volumes ===")
         
-        try:
-            volumes = self.docker_client.volumes.list()
-            
-            volume_list = []
-            for volume in volumes:
-                name = volume.name
-                driver = volume.attrs.get('Driver', 'local')
-                mountpoint = volume.attrs.get('Mountpoint', '')
+        for inventory in inventories:
+            host = inventory.host
+            try:
+                volumes = inventory.volumes or []
+                
+                volume_list = []
+                for volume in volumes:
+                    name = volume.name
+                    driver = volume.attrs.get('Driver', 'local')
+                    mountpoint = volume.attrs.get('Mountpoint', '')
+                    
+                    volume_list.append(f"{name} ({driver}): {mountpoint}")
+                
+                print(f"  Found {len(volume_list)} volumes on {host.name}")
                 
-                volume_list.append(f"{name} ({driver}): {mountpoint}")
+                # Store volume info in host device comments
+                host_device = self.ensure_host_device(host)
+                volume_info = "\n".join(volume_list[:50])  # Limit to 50 volumes
+                
+                if host_device.comments:
+                    # Update or append volume section
+                    comments = host_device.comments
+                    if "=== Docker Volumes ===" in comments:
+                        # Replace existing volume section
+                        parts = comments.split("=== Docker Volumes ===")
+                        comments = parts[0].strip() + f"\n\n=== Docker Volumes ===\n{volume_info}"
+                    else:
+                        comments = f"{comments}\n\n=== Docker Volumes ===\n{volume_info}"
+                else:
+                    comments = f"=== Docker Volumes ===\n{volume_info}"
+                
+                if apply_changes(host_device, {'comments': comments}):
+                    print(f"  ✓ Updated volume info on {host.name}")
+                else:
+                    print(f"  ✓ Volume info unchanged on {host.name}")
             
-            print(f"  Found {len(volume_list)} volumes")
+            except Exception as e:
+                print(f"  ✗ Error syncing volumes on {host.name}: {e}")
+    
+    def prune_stale(self, inventories, complete):
+        """Delete owned VMs, interfaces, IPs and prefixes that Docker no longer reports"""
+        try:
+            pruner = Pruner('docker', self.ensure_owner_tag())
+            removed = []
+            # Owned container IPs are read once and split per host locally; filtering by
+            # every VM ID would put hundreds of parameters into one request line
+            owned_ips = list(self.nb.ipam.ip_addresses.filter(
+                tag=pruner.slug, assigned_object_type='virtualization.vminterface'
+            ))
             
-            # Store volume info in host device comments
-            host_device = self.ensure_host_device()
-            volume_info = "\n".join(volume_list[:50])  # Limit to 50 volumes
+            for inventory in inventories:
+                host = inventory.host
+                cluster = self.ensure_cluster(host)
+                containers = {container.name for container in inventory.containers}
+                attachments = {
+                    (container.name, net_name, net_config['IPAddress'])
+                    for container in inventory.containers
+                    for net_name, net_config in container.networks.items()
+                    if net_config.get('IPAddress')
+                }
+                interface_keys = {(name, net_name) for name, net_name, _ in attachments}
+                
+                vms, interfaces = self.nb_async.gather(
+                    self.nb_async.list('virtual_machines', cluster_id=cluster.id, tag=pruner.slug),
+                    self.nb_async.list('vm_interfaces', cluster_id=cluster.id, tag=pruner.slug)
+                )
+                vm_ids = {vm.id for vm in vms}
+                ips = [
+                    ip_obj for ip_obj in owned_ips
+                    if ip_obj.assigned_object and ip_obj.assigned_object.virtual_machine.id in vm_ids
+                ]
+                
+                # Deleting a VM or interface cascades to what is assigned to it
+                stale_vms = pruner.check(self.nb.virtualization.virtual_machines, vms, containers,
+                                         lambda vm: vm.name, f'container VM on {host.name}')
+                removed.extend((vm, f"{host.name}/{vm.name}") for vm in stale_vms)
+                gone = {vm.name for vm in stale_vms}
+                interfaces = [iface for iface in interfaces if iface.virtual_machine.name not in gone]
+                stale_interfaces = pruner.check(self.nb.virtualization.interfaces, interfaces, interface_keys,
+                                                lambda iface: (iface.virtual_machine.name, iface.name),
+                                                f'container interface on {host.name}')
+                gone_interfaces = {iface.id for iface in stale_interfaces}
+                ips = [
+                    ip_obj for ip_obj in ips
+                    if ip_obj.assigned_object_id not in gone_interfaces
+                    and ip_obj.assigned_object.virtual_machine.name not in gone
+                ]
+                pruner.check(self.nb.ipam.ip_addresses, ips, attachments,
+                             lambda ip_obj: (ip_obj.assigned_object.virtual_machine.name,
+                                             ip_obj.assigned_object.name,
+                                             ip_obj.address.split('/')[0]),
+                             f'container IP on {host.name}')
             
-            if host_device.comments:
-                # Update or append volume section
-                comments = host_device.comments
-                if "=== Docker Volumes ===" in comments:
-                    # Replace existing volume section
-                    parts = comments.split("=== Docker Volumes ===")
-                    host_device.comments = parts[0].strip() + f"\n\n=== Docker Volumes ===\n{volume_info}"
-                else:
-                    host_device.comments = f"{comments}\n\n=== Docker Volumes ===\n{volume_info}"
-            else:
-                host_device.comments = f"=== Docker Volumes ===\n{volume_info}"
+            # Subnets can be shared between hosts, so prefixes need every host's networks
+            if complete:
+                subnets = set()
+                for inventory in inventories:
+                    subnets |= self.get_docker_subnets(inventory)
+                pruner.check(self.nb.ipam.prefixes, self.nb.ipam.prefixes.filter(tag=pruner.slug), subnets,
+                             lambda prefix: prefix.prefix, 'Docker network prefix')
             
-            host_device.save()
-            print(f"  ✓ Updated volume info on {DOCKER_HOST}")
+            deleted = {id(record) for record in pruner.run()}
+            for vm, key in removed:
+                if id(vm) in deleted:
+                    self.state.forget('container', key)
         
         except Exception as e:
-            print(f"  ✗ Error syncing volumes: {e}")
+            print(f"  ✗ Error pruning stale objects: {e}")
     
     def run(self):
         """Main sync routine"""
-        print("Starting Docker sync...")
+        print(f"Starting Docker sync for {len(self.hosts)} host(s)...")
         
         try:
-            # Get Docker info
-            info = self.docker_client.info()
-            print(f"✓ Connected to Docker: {info['Name']}")
-            print(f"  Containers: {info['Containers']} ({info['ContainersRunning']} running)")
-            print(f"  Images: {info['Images']}")
+            inventories, failed = self.enumerate_hosts()
+            # Event batches in watch mode reuse these until the next full run
+            self.netbox_prefixes = None
+            
+            if inventories:
+                self.sync_networks(inventories)
+                self.sync_containers(inventories)
+                self.sync_volumes(inventories)
+                self.prune_stale(inventories, complete=not failed)
+                self.resolver.save()
+                self.state.commit()
+                if self.stats:
+                    self.stats.save()
             
-            self.sync_networks()
-            self.sync_containers()
-            self.sync_volumes()
+            if failed:
+                print(f"\n✗ Docker sync incomplete, unreachable hosts: {', '.join(failed)}")
+                return False
             
             print("\n✓ Docker sync completed successfully!")
             return True
@@ -348,8 +803,116 @@ class DockerSync:
         except Exception as e:
             print(f"\n✗ Docker sync failed: {e}")
             return False
+    
+    def watch(self):
+        """Full reconcile, then sync only the objects named in Docker events"""
+        print("Starting Docker event watcher...")
+        pending = {}
+        lock = threading.Lock()
+        resync = threading.Event()
+        resync.set()
+        
+        def consume(host):
+            while True:
+                try:
+                    events = host.client.events(decode=True, filters={
+                        'type': list(WATCHED_EVENTS),
+                        'event': sorted({e for events in WATCHED_EVENTS.values() for e in events})
+                    })
+                    for event in events:
+                        key = self.event_key(event)
+                        if key:
+                            with lock:
+                                pending[(host.name, *key)] = (time.monotonic(), event)
+                except Exception as e:
+                    print(f"✗ Docker event stream lost on {host.name}: {e}; reconnecting")
+                    time.sleep(5)
+                    # Events may have been missed while disconnected
+                    resync.set()
+        
+        for host in self.hosts:
+            threading.Thread(target=consume, args=(host,), name=f'docker-events-{host.name}', daemon=True).start()
+        
+        while True:
+            if resync.is_set():
+                resync.clear()
+                with lock:
+                    pending.clear()
+                self.run()
+                print("\n✓ Watching Docker events...")
+            
+            time.sleep(max(DOCKER_EVENT_DEBOUNCE / 2, 0.1))
+            now = time.monotonic()
+            with lock:
+                due = {k: event for k, (seen, event) in pending.items() if now - seen >= DOCKER_EVENT_DEBOUNCE}
+                for key in due:
+                    del pending[key]
+            if due:
+                try:
+                    self.sync_events(due)
+                    self.resolver.save()
+                    self.state.commit()
+                    if self.stats:
+                        self.stats.save()
+                except Exception as e:
+                    print(f"✗ Error handling Docker events: {e}")
+    
+    def event_key(self, event):
+        """Coalesce an event to the (type, id) of the object that needs syncing"""
+        event_type = event.get('Type')
+        actor = event.get('Actor', {})
+        action = event.get('Action', '')
+        if event_type == 'network' and action in ('connect', 'disconnect'):
+            # Attachments change the container's interfaces, not the network
+            return ('container', actor.get('Attributes', {}).get('container'))
+        if event_type in WATCHED_EVENTS and action in WATCHED_EVENTS[event_type]:
+            return (event_type, actor.get('ID'))
+        return None
+    
+    def sync_events(self, due):
+        """Sync the objects named in a batch of debounced events"""
+        print(f"\n→ {len(due)} changed objects from Docker events")
+        inventories = []
+        removed = {}
+        
+        for host in self.hosts:
+            events = {(kind, obj_id): event for (name, kind, obj_id), event in due.items() if name == host.name}
+            if not events:
+                continue
+            container_ids = [obj_id for (kind, obj_id) in events if kind == 'container' and obj_id]
+            network_ids = [obj_id for (kind, obj_id) in events if kind == 'network' and obj_id]
+            
+            inventory = HostInventory(host, partial=True)
+            if network_ids:
+                inventory.networks = host.client.networks.list(ids=network_ids)
+            if container_ids:
+                inventory.containers = self.list_containers(host, filters={'id': container_ids})
+                if self.stats:
+                    inventory.stats = self.stats.collect(host, inventory.containers)
+                found = {container.id for container in inventory.containers}
+                for container_id in container_ids:
+                    event = events[('container', container_id)]
+                    name = event.get('Actor', {}).get('Attributes', {}).get('name')
+                    if container_id not in found and name and event.get('Type') == 'container':
+                        removed.setdefault(host, []).append(name)
+            if any(kind == 'volume' for kind, _ in events):
+                inventory.volumes = host.client.volumes.list()
+            inventories.append(inventory)
+        
+        if any(inventory.networks for inventory in inventories):
+            self.sync_networks(inventories)
+        if any(inventory.containers for inventory in inventories):
+            self.sync_containers(inventories)
+        for host, names in removed.items():
+            self.mark_containers_removed(host, names)
+        volume_changes = [inventory for inventory in inventories if inventory.volumes is not None]
+        if volume_changes:
+            self.sync_volumes(volume_changes)
 
 if __name__ == '__main__':
     sync = DockerSync()
-    success = sync.run()
-    exit(0 if success else 1)
+    if '--watch' in sys.argv[1:]:
+        sync.watch()
+    else:
+        success = sync.run()
+        exit(0 if success else 1)
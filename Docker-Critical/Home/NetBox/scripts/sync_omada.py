@@ -1,13 +1,25 @@
 #!/usr/bin/env python3
 """
 Omada Controller to NetBox Sync Script
-Syncs access points, switches, and network topology from Omada SDN Controller to NetBox
+Syncs access points, switches, switch ports, and LLDP topology from Omada SDN Controller to NetBox
 """
 
 import requests
 import pynetbox
 import os
 import json
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from netbox_snapshot import NetBoxSnapshot
+from netbox_prefixes import PrefixIndex
+from netbox_bulk import BulkWriter
+from netbox_diff import SyncStats, apply_changes
+from netbox_resolver import ReferenceResolver
+from netbox_async import AsyncNetBox
+from netbox_scheduler import WriteScheduler
+from netbox_state import FingerprintStore
+from netbox_prune import Pruner, claim, owned_elsewhere, owner_tag, tag_ids
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 # Suppress SSL warnings if using self-signed certs
@@ -21,16 +33,152 @@ OMADA_SITE_NAME = os.getenv('OMADA_SITE_NAME', 'Default')
 NETBOX_URL = os.getenv('NETBOX_URL', 'http://localhost:8080')
 NETBOX_TOKEN = os.getenv('NETBOX_TOKEN', '')
 VERIFY_SSL = os.getenv('VERIFY_SSL', 'false').lower() == 'true'
+OMADA_PAGE_SIZE = int(os.getenv('OMADA_PAGE_SIZE', '100'))
+SYNC_CACHE_DIR = os.getenv('SYNC_CACHE_DIR', os.path.expanduser('~/.cache/netbox-sync'))
+OMADA_SESSION_CACHE = os.getenv('OMADA_SESSION_CACHE', os.path.join(SYNC_CACHE_DIR, 'omada_session.json'))
+
+# Omada endpoint -> how its devices are recorded in NetBox; comments lists
+# (title, Omada field, unit) lines shown after the MAC address
+# Device comments only carry stable facts: uptime or client counts would change every
+# run, so every device would be PATCHed and never match its fingerprint
+DEVICE_SPECS = {
+    'eaps': {
+        'label': 'AP',
+        'title': 'Access points',
+        'role': 'access-point',
+        'color': '4caf50',
+        'default_model': 'Unknown AP',
+        'comments': [],
+        'interface': 'Management',
+    },
+    'switches': {
+        'label': 'Switch',
+        'title': 'Switches',
+        'role': 'switch',
+        'color': 'ff9800',
+        'default_model': 'Unknown Switch',
+        'comments': [('Ports', 'portNum', '')],
+        'interface': 'Management',
+        'ports': True,
+    },
+    'gateways': {
+        'label': 'Gateway',
+        'title': 'Gateways',
+        'role': 'router',
+        'color': 'f44336',
+        'default_model': 'Unknown Gateway',
+        'comments': [],
+        'interface': 'Management',
+    },
+}
+
+# Switch port tables are fetched with this many requests in flight
+OMADA_PORT_WORKERS = int(os.getenv('OMADA_PORT_WORKERS', '4'))
+
+# Client sync is opt-in; client IPs are written every OMADA_CLIENT_BATCH clients
+OMADA_SYNC_CLIENTS = os.getenv('OMADA_SYNC_CLIENTS', 'false').lower() == 'true'
+OMADA_CLIENT_BATCH = int(os.getenv('OMADA_CLIENT_BATCH', '500'))
+
+# Omada linkSpeed codes -> NetBox interface speed (Kbps) and type
+OMADA_LINK_SPEEDS = {1: 10000, 2: 100000, 3: 1000000, 4: 2500000, 5: 10000000}
+OMADA_PORT_TYPES = {4: '2.5gbase-t', 5: '10gbase-x-sfpp'}
+
+# errorCodes the controller returns when the session or token is no longer valid
+OMADA_AUTH_ERRORS = {-1200, -1005}
+
+class OmadaAuthError(Exception):
+    """The controller rejected the session or Csrf-Token"""
 
 class OmadaSync:
     def __init__(self):
         self.session = requests.Session()
         self.nb = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
         self.nb.http_session.verify = VERIFY_SSL
+        self.resolver = ReferenceResolver(self.nb)
+        self.nb_async = AsyncNetBox(self.nb)
+        self.state = FingerprintStore('omada')
+        self.pending_state = {}
+        self.listed = {}
+        self.switches = []
+        self.prefixes = PrefixIndex()
+        self.tag = None
         self.omada_token = None
         self.controller_id = None
         self.site_id = None
+        self.auth_lock = threading.Lock()
         
+    def connect(self):
+        """Reuse the cached session and IDs if present, otherwise log in and look them up"""
+        if self.load_session():
+            print(f"✓ Reusing cached Omada session (site {self.site_id})")
+            return True
+        if not self.login() or not self.get_controller_info() or not self.get_site_id():
+            return False
+        self.save_session()
+        return True
+    
+    def session_scope(self):
+        return {'url': OMADA_URL, 'username': OMADA_USERNAME, 'site': OMADA_SITE_NAME}
+    
+    def load_session(self):
+        """Restore token, cookies and IDs saved by an earlier run against the same controller"""
+        try:
+            with open(OMADA_SESSION_CACHE) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if cached.get('scope') != self.session_scope() or not cached.get('token'):
+            return False
+        self.omada_token = cached['token']
+        self.session.headers.update({'Csrf-Token': self.omada_token})
+        self.session.cookies.update(cached.get('cookies') or {})
+        self.controller_id = cached['controller_id']
+        self.site_id = cached['site_id']
+        return True
+    
+    def save_session(self):
+        """Persist token, cookies and IDs to a file only the current user can read"""
+        try:
+            os.makedirs(os.path.dirname(OMADA_SESSION_CACHE), exist_ok=True)
+            tmp = f"{OMADA_SESSION_CACHE}.{os.getpid()}.tmp"
+            fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump({
+                    'scope': self.session_scope(),
+                    'token': self.omada_token,
+                    'cookies': self.session.cookies.get_dict(),
+                    'controller_id': self.controller_id,
+                    'site_id': self.site_id
+                }, f)
+            os.replace(tmp, OMADA_SESSION_CACHE)
+        except OSError as e:
+            print(f"✗ Could not write Omada session cache: {e}")
+    
+    def omada_get(self, url, params=None):
+        """GET an Omada API URL, logging in again once if the session has expired"""
+        token = self.omada_token
+        try:
+            return self._get_json(url, params)
+        except OmadaAuthError:
+            # Concurrent page fetches can hit the expiry together; only one logs in
+            with self.auth_lock:
+                if self.omada_token == token:
+                    print("  Omada session expired, logging in again")
+                    if not self.login():
+                        raise
+                    self.save_session()
+            return self._get_json(url, params)
+    
+    def _get_json(self, url, params=None):
+        response = self.session.get(url, params=params, verify=VERIFY_SSL)
+        if response.status_code in (401, 403):
+            raise OmadaAuthError(f"HTTP {response.status_code}")
+        response.raise_for_status()
+        data = response.json()
+        if data.get('errorCode') in OMADA_AUTH_ERRORS:
+            raise OmadaAuthError(data.get('msg', 'Session expired'))
+        return data
+    
     def login(self):
         """Login to Omada Controller and get auth token"""
         url = f"{OMADA_URL}/api/v2/login"
@@ -91,254 +239,515 @@ class OmadaSync:
             print(f"✗ Error getting site info: {e}")
         return False
     
-    def get_omada_data(self, endpoint):
-        """Fetch data from Omada API"""
+    def iter_omada_pages(self, endpoint, page_size=OMADA_PAGE_SIZE):
+        """Yield the rows of a paged Omada endpoint one page at a time"""
         url = f"{OMADA_URL}/api/v2/controllers/{self.controller_id}/sites/{self.site_id}/{endpoint}"
-        try:
-            response = self.session.get(url, verify=VERIFY_SSL)
-            response.raise_for_status()
-            data = response.json()
+        page = 1
+        fetched = 0
+        while True:
+            data = self.omada_get(url, params={
+                'currentPage': page,
+                'currentPageSize': page_size
+            })
+            if data.get('errorCode') != 0:
+                raise RuntimeError(data.get('msg', 'Unknown error'))
             
-            if data.get('errorCode') == 0:
-                return data.get('result', {})
-            else:
-                print(f"✗ API error for {endpoint}: {data.get('msg', 'Unknown error')}")
-        except Exception as e:
-            print(f"✗ Error fetching {endpoint}: {e}")
-        return {}
+            result = data.get('result') or {}
+            if isinstance(result, list):
+                # Endpoint is not paged
+                yield result
+                return
+            rows = result.get('data') or []
+            if rows:
+                yield rows
+            fetched += len(rows)
+            total = result.get('totalRows')
+            if not rows or (total is not None and fetched >= total) or (total is None and len(rows) < page_size):
+                return
+            page += 1
+    
+    def stream_omada_pages(self, endpoints):
+        """Fetch paged endpoints concurrently and yield (endpoint, rows) as pages arrive
+
+        Yields (endpoint, None) once an endpoint has been read completely; an
+        endpoint that fails part way is reported and never marked complete.
+        """
+        pages = queue.Queue()
+        
+        def fetch(endpoint):
+            try:
+                for rows in self.iter_omada_pages(endpoint):
+                    pages.put((endpoint, rows))
+                pages.put((endpoint, None))
+            except Exception as e:
+                print(f"✗ Error fetching {endpoint}: {e}")
+                pages.put((endpoint, e))
+        
+        with ThreadPoolExecutor(max_workers=len(endpoints)) as pool:
+            for endpoint in endpoints:
+                pool.submit(fetch, endpoint)
+            remaining = len(endpoints)
+            while remaining:
+                endpoint, rows = pages.get()
+                if isinstance(rows, Exception):
+                    remaining -= 1
+                    continue
+                if rows is None:
+                    remaining -= 1
+                yield endpoint, rows
     
     def ensure_manufacturer(self, name):
         """Ensure manufacturer exists in NetBox"""
-        manufacturer = self.nb.dcim.manufacturers.get(name=name)
-        if not manufacturer:
-            manufacturer = self.nb.dcim.manufacturers.create(
-                name=name,
-                slug=name.lower().replace(' ', '-')
-            )
-        return manufacturer
+        return self.resolver.manufacturer(name)
     
     def ensure_site(self, name):
         """Ensure site exists in NetBox"""
-        site = self.nb.dcim.sites.get(name=name)
-        if not site:
-            site = self.nb.dcim.sites.create(
-                name=name,
-                slug=name.lower().replace(' ', '-')
-            )
-        return site
+        return self.resolver.site(name)
     
     def ensure_device_role(self, name, color='2196f3'):
         """Ensure device role exists in NetBox"""
-        role = self.nb.dcim.device_roles.get(name=name)
-        if not role:
-            role = self.nb.dcim.device_roles.create(
-                name=name,
-                slug=name.lower().replace(' ', '-'),
-                color=color
-            )
-        return role
+        return self.resolver.device_role(name, color=color)
     
-    def ensure_device_type(self, manufacturer, model):
-        """Ensure device type exists in NetBox"""
-        device_type = self.nb.dcim.device_types.get(model=model)
-        if not device_type:
-            device_type = self.nb.dcim.device_types.create(
-                manufacturer=manufacturer.id,
-                model=model,
-                slug=model.lower().replace(' ', '-').replace('(', '').replace(')', '')
-            )
-        return device_type
+    def ensure_device_types(self, manufacturer, models):
+        """Ensure device types exist in NetBox for every model"""
+        return self.resolver.device_types(manufacturer, models)
     
-    def sync_access_points(self):
-        """Sync Omada access points to NetBox"""
-        print("\n=== Syncing Access Points ===")
-        aps_data = self.get_omada_data('eaps')
-        
-        if not aps_data or 'data' not in aps_data:
-            print("  No access point data available")
-            return
-        
+    def sync_devices(self):
+        """Stream AP, switch and gateway pages concurrently through one spec-driven pipeline"""
+        print("\n=== Syncing Omada Devices ===")
         site = self.ensure_site('homelab')
-        role = self.ensure_device_role('access-point', color='4caf50')
         manufacturer = self.ensure_manufacturer('TP-Link')
+        roles = {
+            endpoint: self.ensure_device_role(spec['role'], color=spec['color'])
+            for endpoint, spec in DEVICE_SPECS.items()
+        }
+        stats = {endpoint: SyncStats(spec['title']) for endpoint, spec in DEVICE_SPECS.items()}
         
-        for ap in aps_data.get('data', []):
-            name = ap.get('name', ap.get('mac', 'unknown'))
-            model = ap.get('model', 'Unknown AP')
-            mac = ap.get('mac', '')
-            ip = ap.get('ip', '')
-            status = ap.get('status', 0)
-            uptime = ap.get('uptime', 0)
-            clients = ap.get('clients', 0)
-            
-            # Create device type if needed
-            device_type = self.ensure_device_type(manufacturer, model)
-            
-            # Get or create device
-            device = self.nb.dcim.devices.get(name=name)
-            if not device:
-                device = self.nb.dcim.devices.create(
-                    name=name,
-                    device_type=device_type.id,
-                    role=role.id,
-                    site=site.id,
-                    status='active' if status == 1 else 'offline',
-                    comments=f"MAC: {mac}\nClients: {clients}\nUptime: {uptime}s"
+        # Existence checks for every kind come from one listing of the site's devices
+        self.nb_site = site
+        self.snapshot = NetBoxSnapshot(self.nb)
+        self.snapshot.load_devices(site_id=site.id)
+        # Masks for management and client IPs come from the longest matching NetBox prefix
+        self.prefixes.load(self.nb)
+        seen = {}
+        
+        for endpoint, rows in self.stream_omada_pages(list(DEVICE_SPECS)):
+            spec = DEVICE_SPECS[endpoint]
+            if rows is None:
+                # Only a fully listed kind may be compared for pruning
+                if spec['label'] in seen:
+                    self.listed[spec['label']] = seen.pop(spec['label'])
+                continue
+            print(f"  {endpoint}: page of {len(rows)}")
+            self.sync_device_page(spec, rows, site, roles[endpoint], manufacturer, stats[endpoint])
+            if spec.get('ports'):
+                self.switches.extend(
+                    (row.get('name', row.get('mac', 'unknown')), row['mac']) for row in rows if row.get('mac')
                 )
-                print(f"  ✓ Created AP: {name}")
-            else:
-                # Update status
-                device.status = 'active' if status == 1 else 'offline'
-                device.comments = f"MAC: {mac}\nClients: {clients}\nUptime: {uptime}s"
-                device.save()
-                print(f"  ✓ Updated AP: {name}")
-            
-            # Sync management interface
-            if ip and mac:
-                self.sync_interface(device, 'Management', ip, mac)
+            seen.setdefault(spec['label'], (roles[endpoint], set()))[1].update(
+                (row.get('name', row.get('mac', 'unknown')), row.get('ip', '')) for row in rows
+            )
+        
+        for endpoint_stats in stats.values():
+            print(f"  {endpoint_stats.summary()}")
     
-    def sync_switches(self):
-        """Sync Omada switches to NetBox"""
-        print("\n=== Syncing Switches ===")
-        switches_data = self.get_omada_data('switches')
+    def sync_device_page(self, spec, rows, site, role, manufacturer, stats):
+        """Queue the device chains for one page of a device kind and run them"""
+        # Resolve every model on the page with one device type query
+        device_types = self.ensure_device_types(
+            manufacturer, {row.get('model', spec['default_model']) for row in rows}
+        )
+        # Existing management IPs for the page, whatever prefix length they were saved with
+        addresses = [row['ip'] for row in rows if row.get('ip') and row.get('mac')]
+        if addresses:
+            self.snapshot.load_ip_addresses(address=addresses)
+        scheduler = WriteScheduler()
+        
+        for row in rows:
+            name = row.get('name', row.get('mac', 'unknown'))
+            mac = row.get('mac', '')
+            ip = row.get('ip', '')
+            comments = [f"MAC: {mac}"] + [
+                f"{title}: {row.get(field, 0)}{unit}" for title, field, unit in spec['comments']
+            ]
+            
+            # Queue device -> interface -> IP chain
+            self.schedule_device(scheduler, stats, spec['label'], name, mac, ip, {
+                'device_type': device_types[row.get('model', spec['default_model'])].id,
+                'role': role.id,
+                'site': site.id,
+                'status': 'active' if row.get('status', 0) == 1 else 'offline',
+                'comments': "\n".join(comments)
+            }, interface=spec['interface'])
         
-        if not switches_data or 'data' not in switches_data:
-            print("  No switch data available")
+        self.run_scheduler(scheduler)
+    
+    def run_scheduler(self, scheduler):
+        """Run queued chains and remember the devices whose whole chain succeeded"""
+        scheduler.run()
+        scheduler.report()
+        with self.state.batch():
+            for key, (device_key, last_key, payload) in self.pending_state.items():
+                if last_key in scheduler.results:
+                    self.state.record('device', key, payload, netbox_id=scheduler.results[device_key].id)
+        self.pending_state.clear()
+    
+    def schedule_device(self, scheduler, stats, label, name, mac, ip, fields, interface='Management'):
+        """Queue the device -> management interface -> IP chain for one Omada device"""
+        payload = {'name': name, 'mac': mac, 'ip': ip, **fields}
+        if self.state.unchanged('device', mac or name, payload):
+            stats.unchanged += 1
             return
         
-        site = self.ensure_site('homelab')
-        role = self.ensure_device_role('switch', color='ff9800')
-        manufacturer = self.ensure_manufacturer('TP-Link')
+        client = self.nb_async
+        tag = self.ensure_owner_tag()
         
-        for switch in switches_data.get('data', []):
-            name = switch.get('name', switch.get('mac', 'unknown'))
-            model = switch.get('model', 'Unknown Switch')
-            mac = switch.get('mac', '')
-            ip = switch.get('ip', '')
-            status = switch.get('status', 0)
-            uptime = switch.get('uptime', 0)
-            port_count = switch.get('portNum', 0)
-            
-            # Create device type if needed
-            device_type = self.ensure_device_type(manufacturer, model)
-            
-            # Get or create device
-            device = self.nb.dcim.devices.get(name=name)
+        async def upsert_device():
+            device = self.snapshot.get_device(name)
             if not device:
-                device = self.nb.dcim.devices.create(
-                    name=name,
-                    device_type=device_type.id,
-                    role=role.id,
-                    site=site.id,
-                    status='active' if status == 1 else 'offline',
-                    comments=f"MAC: {mac}\nPorts: {port_count}\nUptime: {uptime}s"
-                )
-                print(f"  ✓ Created Switch: {name}")
+                device = await client.create('devices', {'name': name, **fields, 'tags': [tag.id]})
+                self.snapshot.add_device(device)
+                stats.created += 1
+                print(f"  ✓ Created {label}: {name}")
+            elif await client.call(apply_changes, device, claim(device, tag, {
+                'status': fields['status'],
+                'comments': fields['comments']
+            })):
+                stats.updated += 1
+                print(f"  ✓ Updated {label}: {name}")
             else:
-                # Update status
-                device.status = 'active' if status == 1 else 'offline'
-                device.comments = f"MAC: {mac}\nPorts: {port_count}\nUptime: {uptime}s"
-                device.save()
-                print(f"  ✓ Updated Switch: {name}")
-            
-            # Sync management interface
-            if ip and mac:
-                self.sync_interface(device, 'Management', ip, mac)
+                stats.unchanged += 1
+            return device
+        
+        device_key = key = scheduler.add(f"device:{mac or name}", upsert_device)
+        
+        # Sync management interface
+        if ip and mac:
+            key = scheduler.add(
+                f"interface:{mac}",
+                lambda device: self.sync_interface(device, interface, mac),
+                after=[key]
+            )
+            key = scheduler.add(
+                f"ip:{mac}",
+                lambda interface: self.sync_interface_ip(interface, ip),
+                after=[key]
+            )
+        self.pending_state[mac or name] = (device_key, key, payload)
+    
+    async def sync_interface(self, device, name, mac_address):
+        """Create or update interface"""
+        client = self.nb_async
+        tag = self.ensure_owner_tag()
+        interface = await client.get('interfaces', device_id=device.id, name=name)
+        if not interface:
+            interface = await client.create('interfaces', {
+                'device': device.id,
+                'name': name,
+                'type': 'other',
+                'mac_address': mac_address if mac_address else None,
+                'tags': [tag.id]
+            })
+        else:
+            desired = {'mac_address': mac_address} if mac_address else {}
+            await client.call(apply_changes, interface, claim(interface, tag, desired))
+        return interface
+    
+    async def sync_interface_ip(self, interface, ip_address):
+        """Create or update the IP address assigned to an interface"""
+        client = self.nb_async
+        tag = self.ensure_owner_tag()
+        address = self.prefixes.with_prefix(ip_address, 24)
+        ip_obj = self.snapshot.get_ip_address(address) or self.snapshot.get_ip_by_host(address)
+        if not ip_obj:
+            ip_obj = await client.create('ip_addresses', {
+                'address': address,
+                'status': 'active',
+                'assigned_object_type': 'dcim.interface',
+                'assigned_object_id': interface.id,
+                'tags': [tag.id]
+            })
+        else:
+            await client.call(apply_changes, ip_obj, claim(ip_obj, tag, {
+                'address': self.prefixes.with_prefix(ip_address, 24, ip_obj.address),
+                'assigned_object_type': 'dcim.interface',
+                'assigned_object_id': interface.id
+            }))
+        return ip_obj
+    
+    def get_switch_tables(self, mac):
+        """Fetch a switch's port table and LLDP neighbours; ports is None if unavailable"""
+        base = f"{OMADA_URL}/api/v2/controllers/{self.controller_id}/sites/{self.site_id}/switches/{mac}"
+        try:
+            data = self.omada_get(f"{base}/ports")
+            if data.get('errorCode') != 0:
+                raise RuntimeError(data.get('msg', 'Unknown error'))
+            ports = data.get('result') or []
+        except Exception as e:
+            print(f"  ✗ Error fetching ports for {mac}: {e}")
+            return None, []
+        try:
+            data = self.omada_get(f"{base}/lldp")
+            neighbours = (data.get('result') or []) if data.get('errorCode') == 0 else []
+        except Exception as e:
+            print(f"  ✗ Error fetching LLDP neighbours for {mac}: {e}")
+            neighbours = []
+        return ports, neighbours
     
-    def sync_gateways(self):
-        """Sync Omada gateways to NetBox"""
-        print("\n=== Syncing Gateways ===")
-        gateways_data = self.get_omada_data('gateways')
+    def port_name(self, number):
+        return f"Port {number}"
+    
+    def port_fields(self, port):
+        """NetBox interface fields for one Omada switch port"""
+        speed = OMADA_LINK_SPEEDS.get(port.get('linkSpeed'))
+        return {
+            'enabled': not port.get('disable', False),
+            'description': port.get('name', ''),
+            'speed': speed,
+        }
+    
+    def sync_switch_ports(self):
+        """Sync every port of the listed switches and cable them to their LLDP neighbours"""
+        if not self.switches:
+            return
+        print("\n=== Syncing Omada Switch Ports ===")
+        stats = SyncStats('Switch ports')
+        tag = self.ensure_owner_tag()
+        
+        # Port and LLDP tables for all switches are fetched concurrently
+        macs = [mac for _, mac in self.switches]
+        with ThreadPoolExecutor(max_workers=min(OMADA_PORT_WORKERS, len(macs))) as pool:
+            tables = dict(zip(macs, pool.map(self.get_switch_tables, macs)))
         
-        if not gateways_data or 'data' not in gateways_data:
-            print("  No gateway data available")
+        changed = []
+        for name, mac in self.switches:
+            ports, neighbours = tables[mac]
+            device = self.snapshot.get_device(name)
+            if ports is None or not device:
+                continue
+            payload = {
+                'ports': {str(port.get('port')): self.port_fields(port) for port in ports},
+                'neighbours': sorted(
+                    (str(n.get('localPort')), str(n.get('sysName')), str(n.get('portId'))) for n in neighbours
+                ),
+            }
+            if self.state.unchanged('ports', mac, payload):
+                stats.unchanged += len(ports)
+                continue
+            changed.append((device, mac, ports, neighbours, payload))
+        if not changed:
+            print(f"  {stats.summary()}")
             return
         
-        site = self.ensure_site('homelab')
-        role = self.ensure_device_role('router', color='f44336')
-        manufacturer = self.ensure_manufacturer('TP-Link')
+        # One paginated listing gives the existing ports of every device on the site
+        self.snapshot.load_interfaces(site_id=self.nb_site.id)
+        writer = BulkWriter()
+        created = {}
+        
+        for device, mac, ports, _, _ in changed:
+            for port in ports:
+                name = self.port_name(port.get('port'))
+                fields = self.port_fields(port)
+                nb_iface = self.snapshot.get_interface(device.id, name)
+                if not nb_iface:
+                    created[(device.id, name)] = writer.create(self.nb.dcim.interfaces, {
+                        'device': device.id,
+                        'name': name,
+                        'type': OMADA_PORT_TYPES.get(port.get('linkSpeed'), '1000base-t'),
+                        **fields,
+                        'tags': [tag.id]
+                    })
+                    stats.created += 1
+                else:
+                    apply_changes(nb_iface, claim(nb_iface, tag, fields), stats, writer)
+        
+        interfaces_created, interfaces_updated = writer.flush()
+        print(f"  Wrote {interfaces_created} new and {interfaces_updated} updated ports in bulk")
+        for pending in created.values():
+            self.snapshot.add_interface(pending.record)
+        
+        cabled = self.sync_lldp_cables(changed, tag)
+        print(f"  ✓ Created {cabled} cables from LLDP neighbours")
+        with self.state.batch():
+            for device, mac, _, _, payload in changed:
+                self.state.record('ports', mac, payload, netbox_id=device.id)
+        print(f"  {stats.summary()}")
+    
+    def sync_lldp_cables(self, changed, tag):
+        """Cable switch ports to the neighbour interface LLDP reports, when both ends are known"""
+        writer = BulkWriter()
+        linked = set()
+        
+        for device, _, _, neighbours, _ in changed:
+            for neighbour in neighbours:
+                local = self.snapshot.get_interface(device.id, self.port_name(neighbour.get('localPort')))
+                remote_device = self.snapshot.get_device(neighbour.get('sysName'))
+                if not local or not remote_device:
+                    continue
+                port_id = str(neighbour.get('portId', ''))
+                remote = (self.snapshot.get_interface(remote_device.id, port_id)
+                          or (port_id.isdigit() and self.snapshot.get_interface(remote_device.id, self.port_name(port_id))))
+                
+                # Both switches report the same link; skip ends that are already cabled
+                pair = frozenset((local.id, remote.id)) if remote else None
+                if not remote or pair in linked or local.cable or remote.cable:
+                    continue
+                linked.add(pair)
+                writer.create(self.nb.dcim.cables, {
+                    'a_terminations': [{'object_type': 'dcim.interface', 'object_id': local.id}],
+                    'b_terminations': [{'object_type': 'dcim.interface', 'object_id': remote.id}],
+                    'status': 'connected',
+                    'tags': [tag.id]
+                })
         
-        for gateway in gateways_data.get('data', []):
-            name = gateway.get('name', gateway.get('mac', 'unknown'))
-            model = gateway.get('model', 'Unknown Gateway')
-            mac = gateway.get('mac', '')
-            ip = gateway.get('ip', '')
-            status = gateway.get('status', 0)
-            uptime = gateway.get('uptime', 0)
+        created, _ = writer.flush()
+        return created
+    
+    def load_address_index(self, tag):
+        """Map host address -> (id, description, tag ids, foreign) with one paginated read
+
+        Only these small tuples are kept rather than full records, so the
+        index stays small on sites with thousands of addresses. Foreign addresses
+        are assigned to an interface or owned by another sync source.
+        """
+        index = {}
+        for ip_obj in self.nb.ipam.ip_addresses.filter():
+            index[str(ip_obj.address).split('/')[0]] = (
+                ip_obj.id, ip_obj.description or '', tuple(tag_ids(ip_obj)),
+                bool(ip_obj.assigned_object_id) or owned_elsewhere(ip_obj, tag)
+            )
+        print(f"  ✓ Indexed {len(index)} existing IP addresses")
+        return index
+    
+    def sync_clients(self):
+        """Stream the controller's client list into IPAM, writing in batches"""
+        print("\n=== Syncing Omada Clients ===")
+        stats = SyncStats('Client IPs')
+        tag = self.ensure_owner_tag()
+        index = self.load_address_index(tag)
+        writer = BulkWriter()
+        endpoint = self.nb.ipam.ip_addresses
+        batch = []
+        
+        def flush():
+            created, updated = writer.flush()
+            print(f"  Wrote {created} new and {updated} updated client IPs")
+            with self.state.batch():
+                for mac, payload in batch:
+                    self.state.record('client', mac, payload)
+            batch.clear()
+        
+        try:
+            for rows in self.iter_omada_pages('clients'):
+                for client in rows:
+                    ip = client.get('ip')
+                    mac = client.get('mac', '')
+                    if not ip or not mac:
+                        continue
+                    name = client.get('name') or client.get('hostName') or mac
+                    payload = {'ip': ip, 'description': f"{name} ({mac})"}
+                    if self.state.unchanged('client', mac, payload):
+                        stats.unchanged += 1
+                        continue
+                    
+                    existing = index.get(ip)
+                    if existing is None:
+                        writer.create(endpoint, {
+                            'address': self.prefixes.with_prefix(ip, 24),
+                            'status': 'active',
+                            'description': payload['description'],
+                            'tags': [tag.id]
+                        })
+                        # Another client reporting the same address must not queue it twice
+                        index[ip] = (None, payload['description'], (tag.id,), False)
+                        stats.created += 1
+                    elif existing[3]:
+                        # Interface addresses belong to the device syncs, and addresses another
+                        # source (e.g. OPNsense leases) describes are left to that source
+                        stats.unchanged += 1
+                        continue
+                    else:
+                        object_id, description, tags, _ = existing
+                        fields = {}
+                        if description != payload['description']:
+                            fields['description'] = payload['description']
+                        if tag.id not in tags:
+                            fields['tags'] = list(tags) + [tag.id]
+                        if fields and object_id is not None:
+                            writer.update(endpoint, object_id, fields)
+                            index[ip] = (object_id, payload['description'], tuple(fields.get('tags', tags)), False)
+                            stats.updated += 1
+                        else:
+                            stats.unchanged += 1
+                    batch.append((mac, payload))
+                
+                # Write between pages so only one batch of clients is held at a time
+                if len(batch) >= OMADA_CLIENT_BATCH:
+                    flush()
+            if batch:
+                flush()
+        except Exception as e:
+            print(f"  ✗ Error syncing clients: {e}")
+        
+        print(f"  {stats.summary()}")
+    
+    def ensure_owner_tag(self):
+        """Ensure the tag marking objects this sync created exists"""
+        if self.tag is None:
+            self.tag = owner_tag(self.resolver, 'omada')
+        return self.tag
+    
+    def prune_stale(self):
+        """Delete owned devices and management IPs the controller no longer reports"""
+        if not self.listed:
+            return
+        try:
+            pruner = Pruner('omada', self.ensure_owner_tag())
+            present = set()
+            stale_devices = []
             
-            # Create device type if needed
-            device_type = self.ensure_device_type(manufacturer, model)
+            # Only kinds that were listed successfully are compared, one device role each
+            for label, (role, devices) in self.listed.items():
+                names = {name for name, _ in devices}
+                stale = pruner.check(self.nb.dcim.devices,
+                                     self.nb.dcim.devices.filter(role_id=role.id, tag=pruner.slug),
+                                     names, lambda device: device.name, label)
+                stale_devices.extend(stale)
+                gone = {device.name for device in stale}
+                present.update((name, ip) for name, ip in devices if name not in gone)
             
-            # Get or create device
-            device = self.nb.dcim.devices.get(name=name)
-            if not device:
-                device = self.nb.dcim.devices.create(
-                    name=name,
-                    device_type=device_type.id,
-                    role=role.id,
-                    site=site.id,
-                    status='active' if status == 1 else 'offline',
-                    comments=f"MAC: {mac}\nUptime: {uptime}s"
-                )
-                print(f"  ✓ Created Gateway: {name}")
-            else:
-                # Update status
-                device.status = 'active' if status == 1 else 'offline'
-                device.comments = f"MAC: {mac}\nUptime: {uptime}s"
-                device.save()
-                print(f"  ✓ Updated Gateway: {name}")
+            # Deleting a device cascades to its interfaces and their IPs
+            names = {name for name, _ in present}
+            ips = [
+                ip_obj for ip_obj in self.nb.ipam.ip_addresses.filter(tag=pruner.slug)
+                if ip_obj.assigned_object and ip_obj.assigned_object.device.name in names
+            ]
+            pruner.check(self.nb.ipam.ip_addresses, ips, present,
+                         lambda ip_obj: (ip_obj.assigned_object.device.name, ip_obj.address.split('/')[0]),
+                         'management IP')
             
-            # Sync management interface
-            if ip and mac:
-                self.sync_interface(device, 'Management', ip, mac)
-    
-    def sync_interface(self, device, name, ip_address, mac_address):
-        """Create or update interface and IP address"""
-        # Get or create interface
-        interface = self.nb.dcim.interfaces.get(device_id=device.id, name=name)
-        if not interface:
-            interface = self.nb.dcim.interfaces.create(
-                device=device.id,
-                name=name,
-                type='other',
-                mac_address=mac_address if mac_address else None
-            )
-        else:
-            if mac_address and interface.mac_address != mac_address:
-                interface.mac_address = mac_address
-                interface.save()
+            # A device that comes back must not be skipped as unchanged
+            deleted = pruner.run()
+            stale_ids = {id(device) for device in stale_devices}
+            self.state.forget_netbox_ids('device', [record.id for record in deleted if id(record) in stale_ids])
         
-        # Create or update IP address
-        if ip_address:
-            ip_obj = self.nb.ipam.ip_addresses.get(address=f"{ip_address}/24")
-            if not ip_obj:
-                ip_obj = self.nb.ipam.ip_addresses.create(
-                    address=f"{ip_address}/24",
-                    status='active',
-                    assigned_object_type='dcim.interface',
-                    assigned_object_id=interface.id
-                )
-            else:
-                ip_obj.assigned_object_type = 'dcim.interface'
-                ip_obj.assigned_object_id = interface.id
-                ip_obj.save()
+        except Exception as e:
+            print(f"  ✗ Error pruning stale objects: {e}")
     
     def run(self):
         """Main sync routine"""
         print("Starting Omada Controller sync...")
         
-        if not self.login():
-            return False
-        
-        if not self.get_controller_info():
-            return False
-        
-        if not self.get_site_id():
+        if not self.connect():
             return False
         
-        self.sync_access_points()
-        self.sync_switches()
-        self.sync_gateways()
+        self.sync_devices()
+        self.sync_switch_ports()
+        if OMADA_SYNC_CLIENTS:
+            self.sync_clients()
+        self.prune_stale()
+        self.resolver.save()
+        self.state.commit()
         
         print("\n✓ Omada sync completed successfully!")
         return True
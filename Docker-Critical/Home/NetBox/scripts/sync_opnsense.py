@@ -6,7 +6,18 @@ Syncs interfaces, VLANs, firewall rules, and routing from OPNsense to NetBox
 
 import requests
 import pynetbox
+import ipaddress
 import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from netbox_snapshot import NetBoxSnapshot
+from netbox_prefixes import PrefixIntervals, plan_prefixes, relation_note
+from netbox_bulk import BulkWriter, ref
+from netbox_diff import SyncStats, apply_changes
+from netbox_resolver import ReferenceResolver
+from netbox_async import AsyncNetBox
+from netbox_state import FingerprintStore, fingerprint
+from netbox_prune import Pruner, claim, owned_elsewhere, owner_tag, tag_ids
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
 # Suppress SSL warnings if using self-signed certs
@@ -20,12 +31,119 @@ NETBOX_URL = os.getenv('NETBOX_URL', 'http://localhost:8080')
 NETBOX_TOKEN = os.getenv('NETBOX_TOKEN', '')
 VERIFY_SSL = os.getenv('VERIFY_SSL', 'false').lower() == 'true'
 
+# search* endpoints are paged with current/rowCount, this many rows per request
+OPNSENSE_PAGE_SIZE = int(os.getenv('OPNSENSE_PAGE_SIZE', '500'))
+
+# local_context_data key the firewall rule set is stored under on the OPNsense device
+FIREWALL_CONTEXT_KEY = 'opnsense_firewall_rules'
+
+# ARP and DHCP lease ingestion is opt-in; the lease endpoint is for the ISC DHCPv4 server
+OPNSENSE_SYNC_LEASES = os.getenv('OPNSENSE_SYNC_LEASES', 'false').lower() == 'true'
+OPNSENSE_ARP_ENDPOINT = os.getenv('OPNSENSE_ARP_ENDPOINT', 'diagnostics/interface/search_arp')
+OPNSENSE_LEASE_ENDPOINT = os.getenv('OPNSENSE_LEASE_ENDPOINT', 'dhcpv4/leases/searchLease')
+
+# kind -> OPNsense API endpoint; all of them are fetched concurrently before any write
+OPNSENSE_ENDPOINTS = {
+    'interfaces': 'interfaces/overview/export',
+    'vlans': 'interfaces/vlan_settings/searchItem',
+    'rules': 'firewall/filter/searchRule',
+    'routes': 'routes/routes/searchRoute',
+}
+if OPNSENSE_SYNC_LEASES:
+    OPNSENSE_ENDPOINTS['arp'] = OPNSENSE_ARP_ENDPOINT
+    OPNSENSE_ENDPOINTS['leases'] = OPNSENSE_LEASE_ENDPOINT
+
+# Hostnames NetBox accepts as an IP address dns_name
+DNS_NAME = re.compile(r'^[0-9A-Za-z._-]+$')
+
+class OPNsenseInterface:
+    """Interface row from interfaces/overview/export"""
+    
+    def __init__(self, row):
+        self.name = row.get('identifier', row.get('descr', 'unknown'))
+        self.mac = row.get('macaddr', '')
+        ip = row.get('ipaddr', '')
+        self.ip = ip if ip and ip != 'None' else None
+        self.enabled = row.get('status', '').lower() == 'up'
+        self.description = row.get('descr', '')
+    
+    def payload(self):
+        """Normalized view of everything the sync writes for the interface"""
+        return {'mac': self.mac, 'ip': self.ip or '', 'enabled': self.enabled, 'descr': self.description}
+
+class OPNsenseVlan:
+    """VLAN row from interfaces/vlan_settings/searchItem"""
+    
+    def __init__(self, row):
+        self.vid = int(row['tag'])
+        self.name = row.get('descr', f"VLAN{row['tag']}")
+
+class OPNsenseRule:
+    """Firewall rule row from firewall/filter/searchRule"""
+    
+    def __init__(self, row):
+        self.uuid = row.get('uuid')
+        self.description = row.get('description', '')
+        self.enabled = str(row.get('enabled', '1')) == '1'
+        # '%field' keys are display copies of other fields
+        self.content = {
+            key: value.strip() if isinstance(value, str) else value
+            for key, value in row.items()
+            if key != 'uuid' and not key.startswith('%')
+        }
+        self.hash = fingerprint({'uuid': self.uuid, **self.content})
+
+class OPNsenseRoute:
+    """Static route row from routes/routes/searchRoute"""
+    
+    def __init__(self, row):
+        self.network = row.get('network')
+        self.gateway = row.get('gateway')
+
+class OPNsenseArpEntry:
+    """ARP table row from diagnostics/interface/search_arp"""
+    
+    def __init__(self, row):
+        self.ip = row.get('ip')
+        self.mac = row.get('mac', '')
+        self.hostname = row.get('hostname', '')
+
+class OPNsenseLease:
+    """DHCP lease row from dhcpv4/leases/searchLease"""
+    
+    def __init__(self, row):
+        self.ip = row.get('address')
+        self.mac = row.get('mac', '')
+        self.hostname = row.get('hostname', '')
+        self.ends = row.get('ends') or None
+        self.expired = row.get('state', 'active') != 'active'
+
+class OPNsenseInventory:
+    """Point-in-time read of every OPNsense endpoint, ready for the NetBox write phase
+    
+    A kind is None when its fetch failed or returned no rows.
+    """
+    
+    def __init__(self, interfaces=None, vlans=None, rules=None, routes=None, arp=None, leases=None):
+        self.interfaces = interfaces
+        self.vlans = vlans
+        self.rules = rules
+        self.routes = routes
+        self.arp = arp
+        self.leases = leases
+
 class OPNsenseSync:
     def __init__(self):
         self.opnsense_session = requests.Session()
         self.opnsense_session.auth = (OPNSENSE_API_KEY, OPNSENSE_API_SECRET)
         self.nb = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
         self.nb.http_session.verify = VERIFY_SSL
+        self.resolver = ReferenceResolver(self.nb)
+        self.nb_async = AsyncNetBox(self.nb)
+        self.state = FingerprintStore('opnsense')
+        self.listed = {}
+        self.pending_state = []
+        self.prefix_intervals = PrefixIntervals()
         
     def get_opnsense_data(self, endpoint):
         """Fetch data from OPNsense API"""
@@ -38,158 +156,364 @@ class OPNsenseSync:
             print(f"Error fetching {endpoint}: {e}")
             return {}
     
+    def get_opnsense_pages(self, endpoint, page_size=OPNSENSE_PAGE_SIZE):
+        """Fetch every row of a search endpoint, paging with current/rowCount"""
+        url = f"{OPNSENSE_URL}/api/{endpoint}"
+        rows = []
+        current = 1
+        try:
+            while True:
+                response = self.opnsense_session.get(url, params={
+                    'current': current,
+                    'rowCount': page_size
+                }, verify=VERIFY_SSL)
+                response.raise_for_status()
+                data = response.json()
+                page = data.get('rows') or []
+                rows.extend(page)
+                total = data.get('total')
+                # A response without a total is not paged
+                if total is None or not page or len(rows) >= int(total):
+                    return {'rows': rows}
+                current += 1
+        except Exception as e:
+            print(f"Error fetching {endpoint}: {e}")
+            return {}
+    
+    def fetch_inventory(self):
+        """Fetch all OPNsense endpoints concurrently into typed models"""
+        models = {
+            'interfaces': OPNsenseInterface,
+            'vlans': OPNsenseVlan,
+            'rules': OPNsenseRule,
+            'routes': OPNsenseRoute,
+            'arp': OPNsenseArpEntry,
+            'leases': OPNsenseLease,
+        }
+        def fetch(endpoint):
+            return self.get_opnsense_pages(endpoint) if '/search' in endpoint else self.get_opnsense_data(endpoint)
+        
+        with ThreadPoolExecutor(max_workers=len(OPNSENSE_ENDPOINTS)) as pool:
+            responses = dict(zip(OPNSENSE_ENDPOINTS, pool.map(fetch, OPNSENSE_ENDPOINTS.values())))
+        
+        inventory = OPNsenseInventory()
+        for kind, data in responses.items():
+            if not data or 'rows' not in data:
+                print(f"  No {kind} data available")
+                continue
+            rows = data['rows']
+            if kind == 'vlans':
+                rows = [row for row in rows if row.get('tag')]
+            setattr(inventory, kind, [models[kind](row) for row in rows])
+            print(f"  ✓ Fetched {len(rows)} {kind}")
+        return inventory
+    
+    def prefetch(self, device, inventory):
+        """Load every NetBox object the write phase compares against, concurrently"""
+        snapshot = NetBoxSnapshot(self.nb)
+        lists = {'interfaces': self.nb_async.list('interfaces', device_id=device.id)}
+        addresses = [iface.ip for iface in inventory.interfaces or [] if iface.ip]
+        vids = [vlan.vid for vlan in inventory.vlans or []]
+        networks = [route.network for route in inventory.routes or [] if route.network]
+        if addresses:
+            lists['ip_addresses'] = self.nb_async.list('ip_addresses', address=addresses)
+        if vids:
+            lists['vlans'] = self.nb_async.list('vlans', vid=vids)
+        if networks:
+            # Every prefix, not just the route networks, so containment and overlap are visible
+            lists['prefixes'] = self.nb_async.list('prefixes')
+        # Address index for lease/ARP upserts: every IP inside the firewall's subnets,
+        # or the observed addresses themselves when no subnet is known
+        subnets = [str(net) for net in self.interface_networks(inventory)]
+        hosts = sorted({entry.ip for entry in (inventory.arp or []) + (inventory.leases or []) if entry.ip})
+        if subnets and hosts:
+            lists['lease_ips'] = self.nb_async.list('ip_addresses', parent=subnets)
+        elif hosts:
+            for i in range(0, len(hosts), 100):
+                lists[f'lease_ips:{i}'] = self.nb_async.list('ip_addresses', address=hosts[i:i + 100])
+        
+        results = dict(zip(lists, self.nb_async.gather(*lists.values())))
+        for interface in results['interfaces']:
+            snapshot.add_interface(interface)
+        for name, records in results.items():
+            if name == 'ip_addresses' or name.startswith('lease_ips'):
+                for ip_obj in records:
+                    snapshot.add_ip_address(ip_obj)
+        for vlan in results.get('vlans', []):
+            snapshot.add_vlan(vlan)
+        self.prefix_intervals = PrefixIntervals()
+        self.prefix_intervals.extend((prefix.prefix, prefix) for prefix in results.get('prefixes', []))
+        for prefix in results.get('prefixes', []):
+            snapshot.add_prefix(prefix)
+        print(f"  ✓ Loaded snapshot: {len(snapshot.interfaces)} interfaces, {len(snapshot.ip_addresses)} IPs, "
+              f"{len(snapshot.vlans)} VLANs, {len(snapshot.prefixes)} prefixes")
+        return snapshot
+    
     def ensure_device_exists(self, name, role='firewall', site='homelab'):
         """Ensure OPNsense device exists in NetBox"""
-        # Get or create device type
-        device_type = self.nb.dcim.device_types.get(model='OPNsense')
-        if not device_type:
-            manufacturer = self.nb.dcim.manufacturers.get(name='Deciso')
-            if not manufacturer:
-                manufacturer = self.nb.dcim.manufacturers.create(name='Deciso', slug='deciso')
-            device_type = self.nb.dcim.device_types.create(
-                manufacturer=manufacturer.id,
-                model='OPNsense',
-                slug='opnsense'
-            )
-        
-        # Get or create site
-        nb_site = self.nb.dcim.sites.get(name=site)
-        if not nb_site:
-            nb_site = self.nb.dcim.sites.create(name=site, slug=site)
-        
-        # Get or create device role
-        nb_role = self.nb.dcim.device_roles.get(name=role)
-        if not nb_role:
-            nb_role = self.nb.dcim.device_roles.create(
-                name=role,
-                slug=role,
-                color='f44336'
-            )
-        
-        # Get or create device
-        device = self.nb.dcim.devices.get(name=name)
-        if not device:
-            device = self.nb.dcim.devices.create(
-                name=name,
-                device_type=device_type.id,
-                role=nb_role.id,
-                site=nb_site.id
-            )
+        manufacturer = self.resolver.manufacturer('Deciso', slug='deciso')
+        device_type = self.resolver.device_type(manufacturer, 'OPNsense', slug='opnsense')
+        nb_site = self.resolver.site(site, slug=site)
+        nb_role = self.resolver.device_role(role, color='f44336', slug=role)
+        device = self.resolver.device(
+            name,
+            device_type=device_type,
+            role=nb_role,
+            site=nb_site
+        )
         
         return device
     
-    def sync_interfaces(self, device):
-        """Sync OPNsense interfaces to NetBox"""
-        # Note: OPNsense API endpoints vary by version
-        # This uses common endpoints - adjust as needed
-        interfaces = self.get_opnsense_data('interfaces/overview/export')
-        
-        if not interfaces or 'rows' not in interfaces:
-            print("  No interface data available")
-            return
-        
-        for iface in interfaces.get('rows', []):
-            name = iface.get('identifier', iface.get('descr', 'unknown'))
-            mac = iface.get('macaddr', '')
-            ip = iface.get('ipaddr', '')
-            status = iface.get('status', '')
-            enabled = status.lower() == 'up'
+    def sync_interfaces(self, device, interfaces, snapshot, writer, tag):
+        """Queue OPNsense interfaces and their IPs"""
+        stats = SyncStats('Interfaces')
+        known_hosts = {address.split('/')[0] for address in snapshot.ip_addresses}
+        
+        for iface in interfaces:
+            payload = iface.payload()
+            if self.state.unchanged('interface', iface.name, payload):
+                stats.unchanged += 1
+                continue
             
             # Get or create interface
-            nb_iface = self.nb.dcim.interfaces.get(device_id=device.id, name=name)
+            nb_iface = snapshot.get_interface(device.id, iface.name)
             if not nb_iface:
-                nb_iface = self.nb.dcim.interfaces.create(
-                    device=device.id,
-                    name=name,
-                    type='1000base-t',
-                    mac_address=mac if mac else None,
-                    enabled=enabled,
-                    description=iface.get('descr', '')
-                )
-                print(f"  Created interface: {name}")
-            else:
-                nb_iface.mac_address = mac if mac else None
-                nb_iface.enabled = enabled
-                nb_iface.description = iface.get('descr', '')
-                nb_iface.save()
-                print(f"  Updated interface: {name}")
+                nb_iface = writer.create(self.nb.dcim.interfaces, {
+                    'device': device.id,
+                    'name': iface.name,
+                    'type': '1000base-t',
+                    'mac_address': iface.mac if iface.mac else None,
+                    'enabled': iface.enabled,
+                    'description': iface.description,
+                    'tags': [tag.id]
+                })
+                stats.created += 1
+                print(f"  Queued interface: {iface.name}")
+            elif apply_changes(nb_iface, claim(nb_iface, tag, {
+                'mac_address': iface.mac if iface.mac else None,
+                'enabled': iface.enabled,
+                'description': iface.description
+            }), stats, writer):
+                print(f"  Updated interface: {iface.name}")
             
             # Sync IP if present
-            if ip and ip != 'None':
-                nb_ip = self.nb.ipam.ip_addresses.get(address=ip)
-                if not nb_ip:
-                    nb_ip = self.nb.ipam.ip_addresses.create(
-                        address=ip,
-                        assigned_object_type='dcim.interface',
-                        assigned_object_id=nb_iface.id
-                    )
-                    print(f"    Added IP: {ip}")
-    
-    def sync_vlans(self, device):
-        """Sync OPNsense VLANs to NetBox"""
-        vlans = self.get_opnsense_data('interfaces/vlan_settings/searchItem')
-        
-        if not vlans or 'rows' not in vlans:
-            print("  No VLAN data available")
-            return
-        
-        for vlan in vlans.get('rows', []):
-            vid = vlan.get('tag')
-            name = vlan.get('descr', f"VLAN{vid}")
+            if iface.ip and iface.ip.split('/')[0] not in known_hosts:
+                writer.create(self.nb.ipam.ip_addresses, {
+                    'address': iface.ip,
+                    'assigned_object_type': 'dcim.interface',
+                    'assigned_object_id': ref(nb_iface),
+                    'tags': [tag.id]
+                })
+                known_hosts.add(iface.ip.split('/')[0])
+                print(f"    Added IP: {iface.ip}")
             
-            if not vid:
+            self.pending_state.append(('interface', iface.name, payload, nb_iface))
+        
+        print(f"  {stats.summary()}")
+    
+    def sync_vlans(self, vlans, snapshot, writer, tag):
+        """Queue OPNsense VLANs"""
+        stats = SyncStats('VLANs')
+        queued = {}
+        
+        for vlan in vlans:
+            if self.state.unchanged('vlan', vlan.vid, {'name': vlan.name}):
+                stats.unchanged += 1
                 continue
             
             # Get or create VLAN
-            nb_vlan = self.nb.ipam.vlans.get(vid=vid)
+            nb_vlan = snapshot.get_vlan(vlan.vid) or queued.get(vlan.vid)
             if not nb_vlan:
-                nb_vlan = self.nb.ipam.vlans.create(
-                    vid=vid,
-                    name=name
-                )
-                print(f"  Created VLAN: {vid} - {name}")
-            else:
-                nb_vlan.name = name
-                nb_vlan.save()
-                print(f"  Updated VLAN: {vid} - {name}")
+                nb_vlan = writer.create(self.nb.ipam.vlans, {
+                    'vid': vlan.vid,
+                    'name': vlan.name,
+                    'tags': [tag.id]
+                })
+                queued[vlan.vid] = nb_vlan
+                stats.created += 1
+                print(f"  Queued VLAN: {vlan.vid} - {vlan.name}")
+            elif apply_changes(nb_vlan, claim(nb_vlan, tag, {'name': vlan.name}), stats, writer):
+                print(f"  Updated VLAN: {vlan.vid} - {vlan.name}")
+            self.pending_state.append(('vlan', vlan.vid, {'name': vlan.name}, nb_vlan))
+        
+        print(f"  {stats.summary()}")
     
-    def sync_firewall_rules(self, device):
-        """Store firewall rules as device custom field (summary)"""
-        rules = self.get_opnsense_data('firewall/filter/searchRule')
+    def sync_firewall_rules(self, device, rules, writer):
+        """Store the full rule set in the device's config context, keyed by rule UUID"""
+        print(f"  Found {len(rules)} firewall rules")
+        context = dict(device.local_context_data or {})
+        stored = context.get(FIREWALL_CONTEXT_KEY) or {}
+        current = {rule.uuid: rule for rule in rules if rule.uuid}
+        
+        # Rules are compared by hash, so an unchanged rule set writes nothing
+        added = [uuid for uuid in current if uuid not in stored]
+        removed = [uuid for uuid in stored if uuid not in current]
+        changed = [
+            uuid for uuid, rule in current.items()
+            if uuid in stored and stored[uuid].get('hash') != rule.hash
+        ]
+        print(f"  Rules: {len(added)} added, {len(changed)} changed, {len(removed)} removed, "
+              f"{len(current) - len(added) - len(changed)} unchanged")
         
-        if not rules or 'rows' not in rules:
-            print("  No firewall rule data available")
-            return
+        desired = {'custom_fields': {'firewall_rule_count': len(rules)}}
+        if added or changed or removed:
+            rule_set = {uuid: entry for uuid, entry in stored.items() if uuid in current}
+            for uuid in added + changed:
+                rule_set[uuid] = {'hash': current[uuid].hash, **current[uuid].content}
+            context[FIREWALL_CONTEXT_KEY] = rule_set
+            desired['local_context_data'] = context
+        apply_changes(device, desired, writer=writer)
+    
+    def interface_networks(self, inventory):
+        """Subnets of the firewall's own interface addresses"""
+        networks = set()
+        for iface in inventory.interfaces or []:
+            if iface.ip and '/' in iface.ip:
+                try:
+                    networks.add(ipaddress.ip_interface(iface.ip).network)
+                except ValueError:
+                    continue
+        return networks
+    
+    def sync_leases(self, inventory, snapshot, writer, tag):
+        """Upsert IPs seen in the ARP table and DHCP leases, and deprecate expired leases"""
+        stats = SyncStats('Lease/ARP IPs')
+        networks = self.interface_networks(inventory)
+        by_host = {address.split('/')[0]: ip_obj for address, ip_obj in snapshot.ip_addresses.items()}
         
-        rule_count = len(rules.get('rows', []))
-        print(f"  Found {rule_count} firewall rules")
+        # One observation per address; a lease carries more detail than an ARP entry
+        seen = {}
+        for entry in inventory.arp or []:
+            if entry.ip:
+                seen[entry.ip] = {'mac': entry.mac, 'hostname': entry.hostname, 'ends': None, 'lease': False}
+        for lease in inventory.leases or []:
+            if lease.ip and not lease.expired:
+                seen[lease.ip] = {'mac': lease.mac, 'hostname': lease.hostname, 'ends': lease.ends, 'lease': True}
         
-        # Store rule summary in custom field
-        # (Full rule sync would require custom tables or using config contexts)
-        device.custom_fields['firewall_rule_count'] = rule_count
-        device.save()
+        for ip, observed in seen.items():
+            try:
+                host = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            network = next((net for net in networks if host in net), None)
+            prefix_length = network.prefixlen if network else host.max_prefixlen
+            
+            description = f"MAC {observed['mac']}" if observed['mac'] else 'ARP entry'
+            if observed['ends']:
+                description += f", lease ends {observed['ends']}"
+            fields = {
+                'status': 'dhcp' if observed['lease'] else 'active',
+                'dns_name': observed['hostname'] if DNS_NAME.match(observed['hostname'] or '') else '',
+                'description': description,
+            }
+            if self.state.unchanged('lease', ip, fields):
+                stats.unchanged += 1
+                continue
+            
+            ip_obj = by_host.get(ip)
+            if not ip_obj:
+                ip_obj = writer.create(self.nb.ipam.ip_addresses, {
+                    'address': f"{ip}/{prefix_length}",
+                    **fields,
+                    'tags': [tag.id]
+                })
+                stats.created += 1
+            elif ip_obj.assigned_object_id or owned_elsewhere(ip_obj, tag):
+                # Interface addresses belong to the interface sync, and client
+                # addresses another source already describes are left to it
+                stats.unchanged += 1
+                continue
+            else:
+                apply_changes(ip_obj, claim(ip_obj, tag, fields), stats, writer)
+            self.pending_state.append(('lease', ip, fields, ip_obj))
+        print(f"  {stats.summary()}")
+        
+        # Owned lease IPs whose lease is gone or expired are marked in the same flush
+        if inventory.leases is not None:
+            expired = [
+                ip_obj for host, ip_obj in by_host.items()
+                if host not in seen and ip_obj.status and ip_obj.status.value == 'dhcp'
+                and not ip_obj.assigned_object_id and tag.id in tag_ids(ip_obj)
+            ]
+            for ip_obj in expired:
+                writer.update(self.nb.ipam.ip_addresses, ip_obj.id, {'status': 'deprecated'})
+                self.state.forget('lease', str(ip_obj.address).split('/')[0])
+            print(f"  Marked {len(expired)} expired leases as deprecated")
     
-    def sync_routes(self, device):
-        """Sync static routes to NetBox prefixes"""
-        routes = self.get_opnsense_data('routes/routes/searchRoute')
+    def sync_routes(self, routes, writer, tag):
+        """Reconcile static routes against every NetBox prefix, reporting conflicts before writing"""
+        gateways = {}
+        for route in routes:
+            if route.network:
+                gateways.setdefault(route.network, route.gateway)
+        creates, matches, conflicts = plan_prefixes(self.prefix_intervals, gateways)
         
-        if not routes or 'rows' not in routes:
-            print("  No route data available")
-            return
+        for network, duplicates in conflicts:
+            print(f"  ✗ Skipped prefix {network} via {gateways[network]}: "
+                  f"{len(duplicates)} copies already exist in the global VRF")
         
-        for route in routes.get('rows', []):
-            network = route.get('network')
-            gateway = route.get('gateway')
+        stats = SyncStats('Route prefixes')
+        for network, relation, related in creates:
+            writer.create(self.nb.ipam.prefixes, {
+                'prefix': network,
+                'description': f"Route via {gateways[network]}",
+                'tags': [tag.id]
+            })
+            stats.created += 1
+            print(f"  Queued prefix: {network}{relation_note(relation, related)}")
+        for network, prefix in matches:
+            # Only prefixes this sync created follow the route; others are left as they are
+            if tag.id not in tag_ids(prefix):
+                stats.unchanged += 1
+            elif apply_changes(prefix, {'description': f"Route via {gateways[network]}"}, stats, writer):
+                print(f"  Updated prefix: {network}")
+        print(f"  {stats.summary()}, {len(conflicts)} conflicts")
+    
+    def prune_stale(self, device):
+        """Delete owned interfaces, IPs, VLANs and route prefixes OPNsense no longer reports"""
+        try:
+            pruner = Pruner('opnsense', owner_tag(self.resolver, 'opnsense'))
+            fingerprints = []
+            
+            # Only kinds that were listed successfully are compared
+            if 'interface' in self.listed:
+                interfaces = self.listed['interface']
+                names = {iface.name for iface in interfaces}
+                stale = pruner.check(self.nb.dcim.interfaces,
+                                     self.nb.dcim.interfaces.filter(device_id=device.id, tag=pruner.slug),
+                                     names, lambda iface: iface.name, 'interface')
+                fingerprints.extend(('interface', iface) for iface in stale)
+                
+                # Deleting an interface also deletes the IPs assigned to it
+                gone = {iface.id for iface in stale}
+                addresses = {(iface.name, iface.ip) for iface in interfaces if iface.ip}
+                ips = [
+                    ip_obj for ip_obj in self.nb.ipam.ip_addresses.filter(device_id=device.id, tag=pruner.slug)
+                    if ip_obj.assigned_object_id not in gone
+                ]
+                pruner.check(self.nb.ipam.ip_addresses, ips, addresses,
+                             lambda ip_obj: (ip_obj.assigned_object.name, ip_obj.address), 'IP address')
+            
+            if 'vlan' in self.listed:
+                vids = {vlan.vid for vlan in self.listed['vlan']}
+                stale = pruner.check(self.nb.ipam.vlans, self.nb.ipam.vlans.filter(tag=pruner.slug),
+                                     vids, lambda vlan: vlan.vid, 'VLAN')
+                fingerprints.extend(('vlan', vlan) for vlan in stale)
+            
+            if 'route' in self.listed:
+                networks = {route.network for route in self.listed['route'] if route.network}
+                pruner.check(self.nb.ipam.prefixes, self.nb.ipam.prefixes.filter(tag=pruner.slug),
+                             networks, lambda prefix: prefix.prefix, 'route prefix')
             
-            if network:
-                # Get or create prefix
-                nb_prefix = self.nb.ipam.prefixes.get(prefix=network)
-                if not nb_prefix:
-                    nb_prefix = self.nb.ipam.prefixes.create(
-                        prefix=network,
-                        description=f"Route via {gateway}"
-                    )
-                    print(f"  Created prefix: {network}")
+            deleted = {id(record) for record in pruner.run()}
+            for kind in ('interface', 'vlan'):
+                self.state.forget_netbox_ids(kind, [
+                    record.id for record_kind, record in fingerprints
+                    if record_kind == kind and id(record) in deleted
+                ])
+        
+        except Exception as e:
+            print(f"  ✗ Error pruning stale objects: {e}")
     
     def run(self):
         """Execute full sync"""
@@ -197,26 +521,60 @@ class OPNsenseSync:
         
         if not OPNSENSE_API_KEY or not OPNSENSE_API_SECRET or not NETBOX_TOKEN:
             print("ERROR: OPNSENSE_API_KEY, OPNSENSE_API_SECRET, and NETBOX_TOKEN must be set")
-            return
+            return False
         
         # Ensure device exists
         print("Ensuring OPNsense device exists in NetBox...")
         device = self.ensure_device_exists('opnsense', role='firewall', site='homelab')
         
-        print("\nSyncing interfaces...")
-        self.sync_interfaces(device)
+        # Read phase: every endpoint at once, so the data is one point in time
+        print("\nFetching OPNsense data...")
+        inventory = self.fetch_inventory()
+        
+        # Write phase: one NetBox prefetch, then one bulk flush for every kind
+        print("\nLoading NetBox snapshot...")
+        snapshot = self.prefetch(device, inventory)
+        writer = BulkWriter()
+        tag = owner_tag(self.resolver, 'opnsense')
+        
+        if inventory.interfaces is not None:
+            print("\nSyncing interfaces...")
+            self.listed['interface'] = inventory.interfaces
+            self.sync_interfaces(device, inventory.interfaces, snapshot, writer, tag)
+        
+        if inventory.vlans is not None:
+            print("\nSyncing VLANs...")
+            self.listed['vlan'] = inventory.vlans
+            self.sync_vlans(inventory.vlans, snapshot, writer, tag)
+        
+        if inventory.rules is not None:
+            print("\nSyncing firewall rules...")
+            self.sync_firewall_rules(device, inventory.rules, writer)
+        
+        if inventory.routes is not None:
+            print("\nSyncing routes...")
+            self.listed['route'] = inventory.routes
+            self.sync_routes(inventory.routes, writer, tag)
         
-        print("\nSyncing VLANs...")
-        self.sync_vlans(device)
+        if inventory.arp is not None or inventory.leases is not None:
+            print("\nSyncing ARP entries and DHCP leases...")
+            self.sync_leases(inventory, snapshot, writer, tag)
         
-        print("\nSyncing firewall rules...")
-        self.sync_firewall_rules(device)
+        created, updated = writer.flush()
+        print(f"\n  Wrote {created} new and {updated} updated objects in bulk")
+        with self.state.batch():
+            for kind, key, payload, record in self.pending_state:
+                self.state.record(kind, key, payload, netbox_id=record.id)
+        self.pending_state.clear()
         
-        print("\nSyncing routes...")
-        self.sync_routes(device)
+        self.prune_stale(device)
+        self.resolver.save()
+        self.state.commit()
         
         print("\n✅ OPNsense sync complete!")
+        return True
 
 if __name__ == '__main__':
     sync = OPNsenseSync()
-    sync.run()
+    success = sync.run()
+    exit(0 if success else 1)
@@ -2,13 +2,33 @@
 """
 TrueNAS Scale to NetBox Sync Script
 Syncs storage pools, datasets, VMs, and network interfaces from TrueNAS to NetBox
+
+Set TRUENAS_TRANSPORT=websocket to query over one JSON-RPC websocket connection,
+and run with --watch to stay connected and re-sync on TrueNAS change events
 """
 
 import requests
 import pynetbox
+import codecs
+import json
 import os
+import re
+import ssl
+import sys
+import time
+from netbox_snapshot import NetBoxSnapshot
+from netbox_bulk import BulkWriter, ref
+from netbox_diff import SyncStats, apply_changes
+from netbox_resolver import ReferenceResolver
+from netbox_state import FingerprintStore
+from netbox_prune import Pruner, claim, owner_tag, tag_ids
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
 # Suppress SSL warnings if using self-signed certs
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -19,6 +39,174 @@ NETBOX_URL = os.getenv('NETBOX_URL', 'http://localhost:8080')
 NETBOX_TOKEN = os.getenv('NETBOX_TOKEN', '')
 VERIFY_SSL = os.getenv('VERIFY_SSL', 'false').lower() == 'true'
 
+# 'rest' or 'websocket'; websocket needs the websocket-client package and falls
+# back to REST when it is missing or the connection fails
+TRUENAS_TRANSPORT = os.getenv('TRUENAS_TRANSPORT', 'rest').lower()
+TRUENAS_WS_URL = os.getenv(
+    'TRUENAS_WS_URL',
+    TRUENAS_URL.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1) + '/api/current'
+)
+TRUENAS_RPC_TIMEOUT = int(os.getenv('TRUENAS_RPC_TIMEOUT', '30'))
+TRUENAS_EVENT_DEBOUNCE = float(os.getenv('TRUENAS_EVENT_DEBOUNCE', '5'))
+
+# Datasets are listed TRUENAS_PAGE_SIZE at a time and written in batches of the same size
+TRUENAS_PAGE_SIZE = int(os.getenv('TRUENAS_PAGE_SIZE', '200'))
+DATASET_FIELDS = ['id', 'type', 'used', 'available', 'volsize', 'mountpoint']
+
+# REST endpoint -> (JSON-RPC query method, fields the sync actually reads)
+RPC_QUERIES = {
+    'pool': ('pool.query', ['name', 'status', 'size', 'allocated', 'free']),
+    'interface': ('interface.query', ['name', 'mtu', 'state']),
+    'vm': ('vm.query', ['name', 'vcpus', 'memory', 'status']),
+}
+
+# Characters that change the scanner's state outside and inside JSON strings
+JSON_STRUCTURE = re.compile(r'[\[\]{}",]')
+JSON_STRING = re.compile(r'["\\]')
+
+def iter_json_array(chunks):
+    """Decode a JSON array from byte chunks, yielding one element at a time
+
+    Nesting depth and string state are tracked as chunks arrive, so each element
+    is decoded exactly once, when the comma or bracket after it is seen.
+    Raises ValueError if the stream ends before the closing bracket, so a cut-off
+    response is never mistaken for a complete listing.
+    """
+    text = codecs.getincrementaldecoder('utf-8')()
+    pieces = []
+    started = in_string = escaped = False
+    depth = 0
+    for chunk in chunks:
+        data = text.decode(chunk)
+        pos = mark = 0
+        if escaped:
+            # A backslash ended the previous chunk; skip the character it escapes
+            pos, escaped = 1, False
+        while pos < len(data):
+            if in_string:
+                match = JSON_STRING.search(data, pos)
+                if not match:
+                    break
+                if match.group() == '\\':
+                    escaped = match.end() == len(data)
+                    pos = match.end() + 1
+                else:
+                    in_string = False
+                    pos = match.end()
+                continue
+            match = JSON_STRUCTURE.search(data, pos)
+            if not match:
+                break
+            char, pos = match.group(), match.end()
+            if not started:
+                if char != '[' or data[mark:match.start()].strip():
+                    raise ValueError("Expected a JSON array")
+                started, mark = True, pos
+            elif char == '"':
+                in_string = True
+            elif char in '[{':
+                depth += 1
+            elif depth and char in ']}':
+                depth -= 1
+            elif char in ',]' and not depth:
+                element = ''.join(pieces) + data[mark:match.start()]
+                pieces = []
+                mark = pos
+                if element.strip():
+                    yield json.loads(element)
+                if char == ']':
+                    return
+        if started:
+            pieces.append(data[mark:])
+        elif data.strip():
+            raise ValueError("Expected a JSON array")
+    raise ValueError("JSON array ended early")
+
+class TrueNASRPCError(Exception):
+    """The TrueNAS websocket API returned a JSON-RPC error"""
+
+class TrueNASRPC:
+    """Persistent JSON-RPC 2.0 connection to the TrueNAS SCALE websocket API"""
+    
+    def __init__(self, url, api_key):
+        self.url = url
+        self.api_key = api_key
+        self.ws = None
+        self.next_id = 0
+        self.notifications = []
+    
+    def connect(self):
+        """Open the websocket and authenticate with the API key"""
+        sslopt = {} if VERIFY_SSL else {'cert_reqs': ssl.CERT_NONE, 'check_hostname': False}
+        self.ws = websocket.create_connection(self.url, timeout=TRUENAS_RPC_TIMEOUT, sslopt=sslopt)
+        if not self.call('auth.login_with_api_key', [self.api_key]):
+            raise TrueNASRPCError("API key was rejected")
+    
+    def close(self):
+        if self.ws:
+            self.ws.close()
+            self.ws = None
+    
+    def send(self, method, params=None):
+        """Send a request without waiting for its response; returns the request id"""
+        self.next_id += 1
+        self.ws.send(json.dumps({'jsonrpc': '2.0', 'id': self.next_id, 'method': method, 'params': params or []}))
+        return self.next_id
+    
+    def receive(self, ids):
+        """Read until every request id is answered; notifications are queued for later"""
+        results = {}
+        while len(results) < len(ids):
+            message = json.loads(self.ws.recv())
+            if 'id' not in message:
+                self.notifications.append(message)
+                continue
+            if message.get('error'):
+                raise TrueNASRPCError(message['error'].get('message', message['error']))
+            results[message['id']] = message.get('result')
+        return results
+    
+    def call(self, method, params=None):
+        request_id = self.send(method, params)
+        return self.receive([request_id])[request_id]
+    
+    def query_many(self, queries):
+        """Pipeline several *.query calls with field selection; returns {name: rows}"""
+        ids = {
+            name: self.send(method, [[], {'select': select}])
+            for name, (method, select) in queries.items()
+        }
+        results = self.receive(list(ids.values()))
+        return {name: results[request_id] for name, request_id in ids.items()}
+    
+    def subscribe(self, collections):
+        for collection in collections:
+            self.call('core.subscribe', [collection])
+    
+    def wait_for_changes(self, debounce):
+        """Block until a collection changes, then gather events for debounce seconds
+
+        Returns the set of changed collection names, e.g. {'vm.query'}.
+        """
+        changed = set()
+        while not changed:
+            if not self.notifications:
+                self.ws.settimeout(None)
+                self.notifications.append(json.loads(self.ws.recv()))
+            self.ws.settimeout(debounce)
+            try:
+                while True:
+                    self.notifications.append(json.loads(self.ws.recv()))
+            except websocket.WebSocketTimeoutException:
+                pass
+            finally:
+                self.ws.settimeout(TRUENAS_RPC_TIMEOUT)
+            for message in self.notifications:
+                if message.get('method') == 'collection_update':
+                    changed.add(message.get('params', {}).get('collection'))
+            self.notifications.clear()
+        return changed
+
 class TrueNASSync:
     def __init__(self):
         self.truenas = requests.Session()
@@ -28,9 +216,17 @@ class TrueNASSync:
         })
         self.nb = pynetbox.api(NETBOX_URL, token=NETBOX_TOKEN)
         self.nb.http_session.verify = VERIFY_SSL
+        self.resolver = ReferenceResolver(self.nb)
+        self.state = FingerprintStore('truenas')
+        self.failed_fetches = set()
+        self.listed = {}
+        self.rpc = None
+        self.prefetched = {}
         
     def get_truenas_data(self, endpoint):
         """Fetch data from TrueNAS API"""
+        if endpoint in self.prefetched:
+            return self.prefetched.pop(endpoint)
         url = f"{TRUENAS_URL}/api/v2.0/{endpoint}"
         try:
             response = self.truenas.get(url, verify=VERIFY_SSL)
@@ -38,45 +234,21 @@ class TrueNASSync:
             return response.json()
         except Exception as e:
             print(f"Error fetching {endpoint}: {e}")
+            self.failed_fetches.add(endpoint)
             return []
     
     def ensure_device_exists(self, name, role='storage', site='homelab'):
         """Ensure TrueNAS device exists in NetBox"""
-        # Get or create device type
-        device_type = self.nb.dcim.device_types.get(model='TrueNAS-SCALE')
-        if not device_type:
-            manufacturer = self.nb.dcim.manufacturers.get(name='iXsystems')
-            if not manufacturer:
-                manufacturer = self.nb.dcim.manufacturers.create(name='iXsystems', slug='ixsystems')
-            device_type = self.nb.dcim.device_types.create(
-                manufacturer=manufacturer.id,
-                model='TrueNAS-SCALE',
-                slug='truenas-scale'
-            )
-        
-        # Get or create site
-        nb_site = self.nb.dcim.sites.get(name=site)
-        if not nb_site:
-            nb_site = self.nb.dcim.sites.create(name=site, slug=site)
-        
-        # Get or create device role
-        nb_role = self.nb.dcim.device_roles.get(name=role)
-        if not nb_role:
-            nb_role = self.nb.dcim.device_roles.create(
-                name=role,
-                slug=role,
-                color='4caf50'
-            )
-        
-        # Get or create device
-        device = self.nb.dcim.devices.get(name=name)
-        if not device:
-            device = self.nb.dcim.devices.create(
-                name=name,
-                device_type=device_type.id,
-                role=nb_role.id,
-                site=nb_site.id
-            )
+        manufacturer = self.resolver.manufacturer('iXsystems', slug='ixsystems')
+        device_type = self.resolver.device_type(manufacturer, 'TrueNAS-SCALE', slug='truenas-scale')
+        nb_site = self.resolver.site(site, slug=site)
+        nb_role = self.resolver.device_role(role, color='4caf50', slug=role)
+        device = self.resolver.device(
+            name,
+            device_type=device_type,
+            role=nb_role,
+            site=nb_site
+        )
         
         return device
     
@@ -86,25 +258,196 @@ class TrueNASSync:
         
         pool_data = []
         for pool in pools:
+            # Top-level stats when present (always over websocket), else the first data vdev
+            stats = pool if 'size' in pool else pool.get('topology', {}).get('data', [{}])[0].get('stats', {})
             pool_info = {
                 'name': pool.get('name'),
                 'status': pool.get('status'),
-                'size_bytes': pool.get('topology', {}).get('data', [{}])[0].get('stats', {}).get('size', 0),
-                'allocated_bytes': pool.get('topology', {}).get('data', [{}])[0].get('stats', {}).get('allocated', 0),
-                'free_bytes': pool.get('topology', {}).get('data', [{}])[0].get('stats', {}).get('free', 0),
+                'size_bytes': stats.get('size', 0),
+                'allocated_bytes': stats.get('allocated', 0),
+                'free_bytes': stats.get('free', 0),
             }
             pool_data.append(pool_info)
             print(f"  Pool: {pool_info['name']} - {pool_info['status']}")
         
         # Update device custom field (you'll need to create this custom field in NetBox)
-        device.custom_fields['storage_pools'] = str(pool_data)
-        device.save()
+        if apply_changes(device, {'custom_fields': {'storage_pools': str(pool_data)}}):
+            print("  Updated storage pool summary")
         
         return pool_data
     
+    def iter_datasets(self):
+        """Yield datasets and zvols one page at a time using limit/offset"""
+        offset = 0
+        while True:
+            count = 0
+            for dataset in self.fetch_dataset_page(offset):
+                count += 1
+                yield dataset
+            if count < TRUENAS_PAGE_SIZE:
+                return
+            offset += count
+    
+    def fetch_dataset_page(self, offset):
+        """One page of the flat dataset listing, without nested children"""
+        if self.rpc:
+            return self.rpc.call('pool.dataset.query', [[], {
+                'limit': TRUENAS_PAGE_SIZE,
+                'offset': offset,
+                'select': DATASET_FIELDS,
+                'extra': {'flat': True, 'retrieve_children': False}
+            }])
+        # REST takes the same query-options as the websocket call in the GET body
+        response = self.truenas.get(
+            f"{TRUENAS_URL}/api/v2.0/pool/dataset",
+            json={'query-filters': [], 'query-options': {
+                'limit': TRUENAS_PAGE_SIZE,
+                'offset': offset,
+                'select': DATASET_FIELDS,
+                'extra': {'flat': True, 'retrieve_children': False}
+            }},
+            verify=VERIFY_SSL,
+            stream=True
+        )
+        response.raise_for_status()
+        return iter_json_array(response.iter_content(chunk_size=65536))
+    
+    def dataset_payload(self, dataset):
+        """Normalized view of everything the sync writes for a dataset or zvol"""
+        def value(field):
+            return (dataset.get(field) or {}).get('value')
+        
+        return {
+            'type': dataset.get('type'),
+            'used': value('used'),
+            'available': value('available'),
+            'volsize': value('volsize'),
+            'mountpoint': dataset.get('mountpoint'),
+        }
+    
+    def load_dataset_items(self, device):
+        """Index the device's inventory items by dataset path, e.g. tank/media/movies"""
+        items = {item.id: item for item in self.nb.dcim.inventory_items.filter(device_id=device.id)}
+        paths = {}
+        
+        def path(item):
+            if item.id not in paths:
+                parent = items.get(item.parent.id) if item.parent else None
+                paths[item.id] = f"{path(parent)}/{item.name}" if parent else item.name
+            return paths[item.id]
+        
+        return {path(item): item for item in items.values()}
+    
+    def sync_datasets(self, device):
+        """Sync datasets and zvols as inventory items nested under their parent dataset"""
+        stats = SyncStats('Datasets')
+        tag = owner_tag(self.resolver, 'truenas')
+        existing = self.load_dataset_items(device)
+        writer = BulkWriter()
+        handles = {}
+        seen = set()
+        deferred = []
+        batch = []
+        
+        def flush():
+            created, updated = writer.flush()
+            print(f"  Wrote {created} new and {updated} updated datasets in bulk")
+            with self.state.batch():
+                for path, payload in batch:
+                    self.state.record('dataset', path, payload)
+            batch.clear()
+        
+        def queue(dataset, orphan_ok=False):
+            path = dataset['id']
+            parent_path = path.rpartition('/')[0]
+            parent = handles.get(parent_path) or existing.get(parent_path) if parent_path else None
+            if parent_path and parent is None and not orphan_ok:
+                return False
+            
+            payload = self.dataset_payload(dataset)
+            nb_item = existing.get(path)
+            if nb_item and self.state.unchanged('dataset', path, payload):
+                stats.unchanged += 1
+                handles[path] = nb_item
+                return True
+            
+            size = f"{payload['volsize']} volume, " if payload['type'] == 'VOLUME' else ''
+            fields = {
+                'name': path.rpartition('/')[2],
+                'parent': ref(parent) if parent else None,
+                'label': 'Zvol' if payload['type'] == 'VOLUME' else 'Dataset',
+                'description': f"{size}{payload['used']} used, {payload['available']} available"
+            }
+            if not nb_item:
+                handles[path] = writer.create(self.nb.dcim.inventory_items, {
+                    'device': device.id,
+                    **fields,
+                    'tags': [tag.id]
+                })
+                stats.created += 1
+            else:
+                handles[path] = nb_item
+                apply_changes(nb_item, claim(nb_item, tag, fields), stats, writer)
+            batch.append((path, payload))
+            return True
+        
+        try:
+            for dataset in self.iter_datasets():
+                dataset.pop('children', None)
+                seen.add(dataset['id'])
+                if not queue(dataset):
+                    # Parent has not been listed yet
+                    deferred.append(dataset)
+                if len(batch) >= TRUENAS_PAGE_SIZE:
+                    flush()
+            self.listed['dataset'] = seen
+        except Exception as e:
+            print(f"Error fetching pool/dataset: {e}")
+            self.failed_fetches.add('pool/dataset')
+        
+        # Parents are queued before their children; anything still unplaced goes top-level
+        while deferred:
+            remaining = [dataset for dataset in deferred if not queue(dataset)]
+            if len(remaining) == len(deferred):
+                for dataset in remaining:
+                    queue(dataset, orphan_ok=True)
+                break
+            deferred = remaining
+        flush()
+        print(f"  {stats.summary()}")
+    
     def sync_network_interfaces(self, device):
         """Sync TrueNAS network interfaces to NetBox"""
         interfaces = self.get_truenas_data('interface')
+        self.listed['interface'] = interfaces
+        stats = SyncStats('Interfaces')
+        
+        # Skip interfaces whose fingerprint matches the last successful sync
+        payloads = {iface.get('name'): self.interface_payload(iface) for iface in interfaces}
+        changed = []
+        for iface in interfaces:
+            if self.state.unchanged('interface', iface.get('name'), payloads[iface.get('name')]):
+                stats.unchanged += 1
+            else:
+                changed.append(iface)
+        interfaces = changed
+        if not interfaces:
+            print(f"  {stats.summary()}")
+            return
+        
+        # Prefetch the device's interfaces and the IPs we are about to sync
+        cidrs = [
+            f"{alias['address']}/{alias['netmask']}"
+            for iface in interfaces
+            for alias in iface.get('state', {}).get('aliases', [])
+            if alias.get('type') == 'INET' and alias.get('address') and alias.get('netmask')
+        ]
+        snapshot = NetBoxSnapshot(self.nb)
+        snapshot.load_interfaces(device_id=device.id)
+        if cidrs:
+            snapshot.load_ip_addresses(address=cidrs)
+        writer = BulkWriter()
+        tag = owner_tag(self.resolver, 'truenas')
         
         for iface in interfaces:
             name = iface.get('name')
@@ -113,23 +456,24 @@ class TrueNASSync:
             enabled = iface.get('state', {}).get('active', False)
             
             # Get or create interface
-            nb_iface = self.nb.dcim.interfaces.get(device_id=device.id, name=name)
+            nb_iface = snapshot.get_interface(device.id, name)
             if not nb_iface:
-                nb_iface = self.nb.dcim.interfaces.create(
-                    device=device.id,
-                    name=name,
-                    type='1000base-t',
-                    mac_address=mac if mac else None,
-                    mtu=mtu,
-                    enabled=enabled
-                )
-                print(f"  Created interface: {name}")
-            else:
-                # Update existing
-                nb_iface.mac_address = mac if mac else None
-                nb_iface.mtu = mtu
-                nb_iface.enabled = enabled
-                nb_iface.save()
+                nb_iface = writer.create(self.nb.dcim.interfaces, {
+                    'device': device.id,
+                    'name': name,
+                    'type': '1000base-t',
+                    'mac_address': mac if mac else None,
+                    'mtu': mtu,
+                    'enabled': enabled,
+                    'tags': [tag.id]
+                })
+                stats.created += 1
+                print(f"  Queued interface: {name}")
+            elif apply_changes(nb_iface, claim(nb_iface, tag, {
+                'mac_address': mac if mac else None,
+                'mtu': mtu,
+                'enabled': enabled
+            }), stats, writer):
                 print(f"  Updated interface: {name}")
             
             # Sync IP addresses
@@ -139,32 +483,45 @@ class TrueNASSync:
                     netmask = alias.get('netmask')
                     if address and netmask:
                         cidr = f"{address}/{netmask}"
-                        nb_ip = self.nb.ipam.ip_addresses.get(address=cidr)
-                        if not nb_ip:
-                            nb_ip = self.nb.ipam.ip_addresses.create(
-                                address=cidr,
-                                assigned_object_type='dcim.interface',
-                                assigned_object_id=nb_iface.id
-                            )
+                        if not snapshot.get_ip_address(cidr):
+                            writer.create(self.nb.ipam.ip_addresses, {
+                                'address': cidr,
+                                'assigned_object_type': 'dcim.interface',
+                                'assigned_object_id': ref(nb_iface),
+                                'tags': [tag.id]
+                            })
                             print(f"    Added IP: {cidr}")
+        
+        created, updated = writer.flush()
+        print(f"  Wrote {created} new and {updated} updated objects in bulk")
+        with self.state.batch():
+            for iface in interfaces:
+                self.state.record('interface', iface.get('name'), payloads[iface.get('name')])
+        print(f"  {stats.summary()}")
+    
+    def interface_payload(self, iface):
+        """Normalized view of everything the sync writes for an interface"""
+        state = iface.get('state', {})
+        return {
+            'mac': state.get('link_address', ''),
+            'mtu': iface.get('mtu', 1500),
+            'enabled': state.get('active', False),
+            'aliases': sorted(
+                f"{alias.get('address')}/{alias.get('netmask')}"
+                for alias in state.get('aliases', []) if alias.get('type') == 'INET'
+            ),
+        }
     
     def sync_vms(self, device):
         """Sync TrueNAS VMs to NetBox virtual machines"""
         vms = self.get_truenas_data('vm')
+        self.listed['vm'] = vms
         
         # Get or create cluster
-        cluster = self.nb.virtualization.clusters.get(name='TrueNAS-VMs')
-        if not cluster:
-            cluster_type = self.nb.virtualization.cluster_types.get(name='KVM')
-            if not cluster_type:
-                cluster_type = self.nb.virtualization.cluster_types.create(
-                    name='KVM',
-                    slug='kvm'
-                )
-            cluster = self.nb.virtualization.clusters.create(
-                name='TrueNAS-VMs',
-                type=cluster_type.id
-            )
+        cluster = self.ensure_vm_cluster()
+        
+        stats = SyncStats('VMs')
+        tag = None
         
         for vm in vms:
             name = vm.get('name')
@@ -172,47 +529,210 @@ class TrueNASSync:
             memory = vm.get('memory', 1024)
             status = 'active' if vm.get('status', {}).get('state') == 'RUNNING' else 'offline'
             
+            payload = {'cluster': cluster.id, 'vcpus': vcpus, 'memory': memory, 'status': status}
+            if self.state.unchanged('vm', name, payload):
+                stats.unchanged += 1
+                continue
+            
             # Get or create VM
             nb_vm = self.nb.virtualization.virtual_machines.get(name=name)
+            tag = tag or owner_tag(self.resolver, 'truenas')
             if not nb_vm:
                 nb_vm = self.nb.virtualization.virtual_machines.create(
                     name=name,
                     cluster=cluster.id,
                     vcpus=vcpus,
                     memory=memory,
-                    status=status
+                    status=status,
+                    tags=[tag.id]
                 )
+                stats.created += 1
                 print(f"  Created VM: {name}")
-            else:
-                nb_vm.vcpus = vcpus
-                nb_vm.memory = memory
-                nb_vm.status = status
-                nb_vm.save()
+            elif apply_changes(nb_vm, claim(nb_vm, tag, {
+                'vcpus': vcpus,
+                'memory': memory,
+                'status': status
+            }), stats):
                 print(f"  Updated VM: {name}")
+            self.state.record('vm', name, payload, netbox_id=nb_vm.id)
+        
+        print(f"  {stats.summary()}")
+    
+    def ensure_vm_cluster(self):
+        """Ensure the cluster TrueNAS VMs are recorded under exists"""
+        cluster_type = self.resolver.cluster_type('KVM', slug='kvm')
+        return self.resolver.cluster('TrueNAS-VMs', cluster_type)
     
-    def run(self):
+    def prune_stale(self, device):
+        """Delete owned interfaces, IPs, VMs and datasets that TrueNAS no longer reports"""
+        try:
+            pruner = Pruner('truenas', owner_tag(self.resolver, 'truenas'))
+            fingerprints = []
+            
+            if 'interface' in self.listed and 'interface' not in self.failed_fetches:
+                interfaces = self.listed['interface']
+                names = {iface.get('name') for iface in interfaces}
+                addresses = {
+                    (iface.get('name'), f"{alias['address']}/{alias['netmask']}")
+                    for iface in interfaces
+                    for alias in iface.get('state', {}).get('aliases', [])
+                    if alias.get('type') == 'INET' and alias.get('address') and alias.get('netmask')
+                }
+                stale = pruner.check(self.nb.dcim.interfaces,
+                                     self.nb.dcim.interfaces.filter(device_id=device.id, tag=pruner.slug),
+                                     names, lambda iface: iface.name, 'interface')
+                fingerprints.extend(('interface', iface) for iface in stale)
+                # Deleting an interface also deletes the IPs assigned to it
+                gone = {iface.id for iface in stale}
+                ips = [
+                    ip_obj for ip_obj in self.nb.ipam.ip_addresses.filter(device_id=device.id, tag=pruner.slug)
+                    if ip_obj.assigned_object_id not in gone
+                ]
+                pruner.check(self.nb.ipam.ip_addresses, ips, addresses,
+                             lambda ip_obj: (ip_obj.assigned_object.name, ip_obj.address), 'IP address')
+            
+            if 'vm' in self.listed and 'vm' not in self.failed_fetches:
+                names = {vm.get('name') for vm in self.listed['vm']}
+                cluster = self.ensure_vm_cluster()
+                stale = pruner.check(self.nb.virtualization.virtual_machines,
+                                     self.nb.virtualization.virtual_machines.filter(cluster_id=cluster.id, tag=pruner.slug),
+                                     names, lambda vm: vm.name, 'VM')
+                fingerprints.extend(('vm', vm) for vm in stale)
+            
+            items = {}
+            if 'dataset' in self.listed and 'pool/dataset' not in self.failed_fetches:
+                listed = self.listed['dataset']
+                items = self.load_dataset_items(device)
+                paths = {id(item): path for path, item in items.items()}
+                # Deleting an item also deletes the items nested under it, so a stale
+                # item is only offered when its parent stays
+                owned = [
+                    item for path, item in items.items()
+                    if pruner.tag.id in tag_ids(item)
+                    and (path.rpartition('/')[0] in listed or path.rpartition('/')[0] not in items)
+                ]
+                stale = pruner.check(self.nb.dcim.inventory_items, owned, listed,
+                                     lambda item: paths[id(item)], 'dataset')
+                fingerprints.extend(('dataset', item) for item in stale)
+            
+            deleted = {id(record) for record in pruner.run()}
+            for kind, record in fingerprints:
+                if id(record) not in deleted:
+                    continue
+                if kind == 'dataset':
+                    gone = paths[id(record)]
+                    for path in items:
+                        if path == gone or path.startswith(f"{gone}/"):
+                            self.state.forget('dataset', path)
+                else:
+                    self.state.forget(kind, record.name)
+        
+        except Exception as e:
+            print(f"  ✗ Error pruning stale objects: {e}")
+    
+    def prefetch(self, endpoints):
+        """Fetch endpoints in one round trip over the websocket API when it is enabled"""
+        if TRUENAS_TRANSPORT != 'websocket':
+            return
+        if websocket is None:
+            print("  websocket-client is not installed, using the REST API")
+            return
+        try:
+            if self.rpc is None:
+                rpc = TrueNASRPC(TRUENAS_WS_URL, TRUENAS_API_KEY)
+                rpc.connect()
+                self.rpc = rpc
+            self.prefetched = self.rpc.query_many({endpoint: RPC_QUERIES[endpoint] for endpoint in endpoints})
+            print(f"  ✓ Fetched {', '.join(endpoints)} over websocket")
+        except Exception as e:
+            print(f"  ✗ Websocket query failed, using the REST API: {e}")
+            self.close_rpc()
+    
+    def close_rpc(self):
+        if self.rpc:
+            self.rpc.close()
+            self.rpc = None
+    
+    def sync_changes(self, device, collections):
+        """Re-sync only the kinds whose collections changed"""
+        handlers = {
+            'pool': self.sync_storage_pools,
+            'interface': self.sync_network_interfaces,
+            'vm': self.sync_vms,
+        }
+        endpoints = [endpoint for endpoint, (method, _) in RPC_QUERIES.items() if method in collections]
+        print(f"\n→ TrueNAS changes in: {', '.join(endpoints)}")
+        self.failed_fetches.clear()
+        self.listed.clear()
+        self.prefetched = self.rpc.query_many({endpoint: RPC_QUERIES[endpoint] for endpoint in endpoints})
+        for endpoint in endpoints:
+            handlers[endpoint](device)
+        self.prune_stale(device)
+        self.resolver.save()
+        self.state.commit()
+    
+    def watch(self):
+        """Full sync, then re-sync whatever TrueNAS reports as changed"""
+        print("Starting TrueNAS event watcher...")
+        if websocket is None:
+            print("ERROR: --watch needs the websocket-client package")
+            return False
+        
+        while True:
+            try:
+                self.rpc = TrueNASRPC(TRUENAS_WS_URL, TRUENAS_API_KEY)
+                self.rpc.connect()
+                # Subscribe before the full sync so no change falls in between
+                self.rpc.subscribe(method for method, _ in RPC_QUERIES.values())
+                if not self.run(keep_open=True):
+                    return False
+                device = self.ensure_device_exists('truenas01', role='storage', site='homelab')
+                print("\n✓ Watching TrueNAS events...")
+                while True:
+                    self.sync_changes(device, self.rpc.wait_for_changes(TRUENAS_EVENT_DEBOUNCE))
+            except Exception as e:
+                print(f"✗ TrueNAS event stream lost: {e}; reconnecting")
+                self.close_rpc()
+                time.sleep(5)
+    
+    def run(self, keep_open=False):
         """Execute full sync"""
         print("Starting TrueNAS to NetBox sync...")
         
         if not TRUENAS_API_KEY or not NETBOX_TOKEN:
             print("ERROR: TRUENAS_API_KEY and NETBOX_TOKEN must be set")
-            return
+            return False
         
         # Ensure device exists
         print("Ensuring TrueNAS device exists in NetBox...")
         device = self.ensure_device_exists('truenas01', role='storage', site='homelab')
+        self.prefetch(list(RPC_QUERIES))
         
         print("\nSyncing storage pools...")
         self.sync_storage_pools(device)
         
+        print("\nSyncing datasets...")
+        self.sync_datasets(device)
+        
         print("\nSyncing network interfaces...")
         self.sync_network_interfaces(device)
         
         print("\nSyncing VMs...")
         self.sync_vms(device)
         
+        self.prune_stale(device)
+        self.resolver.save()
+        self.state.commit()
+        if not keep_open:
+            self.close_rpc()
+        
         print("\n✅ TrueNAS sync complete!")
+        return True
 
 if __name__ == '__main__':
     sync = TrueNASSync()
-    sync.run()
+    if '--watch' in sys.argv[1:]:
+        success = sync.watch()
+    else:
+        success = sync.run()
+    exit(0 if success else 1)